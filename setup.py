@@ -15,6 +15,7 @@ setup(
     author_email="hansonmcoombs@gmail.com",
     packages=find_packages("src"),
     package_dir={"": "src"},
+    package_data={"gw_detect_power": ["timeit_test_results.txt"]},  # calibrates the multiprocessing cost model
     setup_requires=[],
     tests_require=[],
     extras_require={},
@@ -4,4 +4,4 @@ created matt_dumont
 on: 6/07/23
 """
 
-from gw_detect_power.change_detection_v2 import DetectionPowerCalculator
+from gw_detect_power.change_detection_v2 import DetectionPowerCalculator, RaggedTrueConc
@@ -4,12 +4,22 @@ power calcs
 created matt_dumont
 on: 18/05/23
 """
+import copy
+import functools
+import hashlib
+import importlib.metadata
+import json
+import shutil
+import sqlite3
 import time
 import traceback
+from contextlib import closing
+from multiprocessing import shared_memory
 from pathlib import Path
 import numpy as np
 import pandas as pd
-from scipy import stats
+from scipy import special, stats
+import itertools
 import logging
 import multiprocessing
 import os
@@ -17,9 +27,10 @@ import psutil
 import sys
 import warnings
 
+_logger = logging.getLogger(__name__)
+
 # handle import of optional dependencies
 age_tools_imported = True
-pyhomogeneity_imported = True
 kendal_imported = True
 
 try:
@@ -32,23 +43,13 @@ except ImportError:
         'pip install git+https://github.com/Komanawa-Solutions-Ltd/gw_age_tools'
     )
 
-try:
-    from pyhomogeneity import pettitt_test
-except ImportError:
-    pettitt_test = None
-    pyhomogeneity_imported = False
-    warnings.warn(
-        'pyhomogeneity not installed, pettitt_test will be unavailable, to install run '
-        'pip install pyhomogeneity'
-    )
-
 try:
     from kendall_stats import MannKendall, MultiPartKendall
 except ImportError:
     MannKendall, MultiPartKendall = None, None
     kendal_imported = False
     warnings.warn(
-        'kendall_stats not installed, mann_kendall will be unavailable, to install run '
+        'kendall_stats not installed, mann kendall plotting will be unavailable, to install run '
         'pip install git+https://github.com/Komanawa-Solutions-Ltd/kendall_multipart_kendall.git'
     )
 
@@ -73,9 +74,13 @@ class DetectionPowerCalculator:
     def __init__(self, significance_mode='linear-regression', nsims=1000, min_p_value=0.05, min_samples=10,
                  expect_slope='auto', efficent_mode=True, nparts=None, min_part_size=10, no_trend_alpha=0.50,
                  mpmk_check_step=1, mpmk_efficent_min=10, mpmk_window=0.05,
-                 nsims_pettit=2000,
+                 nsims_pettit=2000, pettitt_null_seed=5585, pettitt_null_cache_dir=None,
+                 pettitt_sequential=False, pettitt_sequential_error=0.01,
                  ncores=None, log_level=logging.INFO, return_true_conc=False, return_noisy_conc_itters=0,
-                 only_significant_noisy=False, print_freq=None):
+                 only_significant_noisy=False, print_freq=None,
+                 adaptive_nsims=False, adaptive_block=100, adaptive_ci_width=5.0, adaptive_threshold=80.0,
+                 adaptive_confidence=0.95, analytic_power=False, screen_power=False, screen_tolerance=0.1,
+                 screen_approximate=False, result_cache_path=None, result_cache_max_entries=None, result_cache_max_age_days=None):
         """
         
         :param significance_mode: significance mode to use, options:
@@ -114,7 +119,8 @@ class DetectionPowerCalculator:
                                noisy data for a smaller window centered on the True change point
                                see: * mpmk_efficent_min, * mpmk_window
 
-                            For Pettitt Test:  Not implemented, will be ignored and a waring passed
+                            For Pettitt Test:  run the test on the noise free data, if no change point is detected
+                              (p >= min_p_value) then the test will not be run on the noisy data
         :param nparts: number of parts to use for the n-section-mann-kendall test (not used for other tests)
         :param min_part_size: minimum number of samples in each part for the n-section-mann-kendall test (not used for
                                 other tests)
@@ -140,6 +146,24 @@ class DetectionPowerCalculator:
                                    step size within the window.
         :param nsims_pettit: number of simulations to run for calculating the pvalue of the pettitt test
                              (not used for other tests)
+        :param pettitt_null_seed: int, seed for the permutation null distribution of the pettitt test statistic. The
+                                  null depends only on the number of samples, so it is generated once per
+                                  (number of samples, nsims_pettit, pettitt_null_seed) and reused for every
+                                  simulation and site (not used for other tests)
+        :param pettitt_null_cache_dir: None or path, if not None the pettitt null distributions are also cached on
+                                       disk in this directory (as .npy files) so that they persist between
+                                       sessions and processes (not used for other tests)
+        :param pettitt_sequential: bool, if True the pettitt p value of each series is estimated sequentially
+                                   (Besag-Clifford style), each series is compared to successive (growing) blocks of
+                                   the null and stops once the Wilson interval of its p value is entirely above or
+                                   below min_p_value.  The null itself is only generated (in blocks of 500
+                                   permutations) while some series is undecided, so nsims_pettit is the maximum number
+                                   of permutations generated.  The number of null permutations generated and the mean
+                                   number each series was compared to are returned in the power_calc output
+                                   ('pettitt_perms_generated', 'pettitt_perms_mean') (not used for other tests)
+        :param pettitt_sequential_error: float, the probability (two sided) that the Wilson interval used to stop the
+                                         sequential pettitt permutations does not contain the true p value
+                                         (not used for other tests)
         :param ncores: number of cores to use for multiprocessing, None will use all available cores
         :param log_level: logging level for multiprocessing subprocesses
         :param return_true_conc: return the true concentration time series for each simulation with power calcs
@@ -153,13 +177,71 @@ class DetectionPowerCalculator:
                                        with changes detected then and empty dataframe is returned
         :param print_freq: None or int:  if None then no progress will be printed, if int then progress will be printed
                             every print_freq simulations (n%print_freq==0)
+        :param adaptive_nsims: bool, if True then simulations are run in blocks of adaptive_block and stop once the
+                               Wilson interval of the power is narrower than adaptive_ci_width or lies entirely above
+                               or below adaptive_threshold, nsims is then the maximum number of simulations.  The number
+                               of simulations run and the interval are returned in the power_calc output
+                               ('nsims_run', 'power_lower', 'power_upper')
+        :param adaptive_block: int, number of simulations per block (only used if adaptive_nsims)
+        :param adaptive_ci_width: float, stop once the width of the power interval (percent) is <= this value
+                                  (only used if adaptive_nsims)
+        :param adaptive_threshold: float or None, stop once the power interval (percent) is entirely above or below
+                                   this value, if None only adaptive_ci_width is used (only used if adaptive_nsims)
+        :param adaptive_confidence: float, confidence level of the power interval (only used if adaptive_nsims)
+        :param analytic_power: bool, if True then the power is calculated analytically from the noise free
+                               concentration and the noise (gaussian, sd = error) rather than by simulation, only
+                               available for:
+                                * linear-regression modes: the t statistic of the slope follows a non-central t
+                                  distribution, non-linear true concentrations (e.g. lags) are handled by inflating
+                                  the residual variance by the lack of fit of the noise free data
+                                * mann-kendall modes: normal approximation of the S statistic, the mean and variance of
+                                  S are calculated from the pairwise probabilities of an increase given the noise
+                                  free concentration and the noise (see _analytic_mann_kendall_power)
+                               return_noisy_conc_itters and adaptive_nsims are not supported with analytic_power
+        :param screen_power: bool, if True then (for modes with an analytic power, see analytic_power) bounds of the
+                             analytic power are calculated before simulating and if the upper bound is within
+                             screen_tolerance of 0 or the lower bound within screen_tolerance of 100 then 0 or 100 is
+                             returned without simulating.  The linear-regression bounds are conservative (see
+                             _analytic_linregress_power_bounds), the mann-kendall analytic power is only an
+                             approximation so those modes are only screened if screen_approximate.  Which screen
+                             (if any) removed each
+                             calculation is returned in the power_calc output ('screen': 'analytic_0', 'analytic_100',
+                             'efficient_mode', or 'simulated') and totals are kept in self.screen_counts.
+                             mulitprocess_power_calcs also counts the runs taken from the result cache ('cached')
+                             or a checkpoint ('checkpoint') so the counts add up to the number of runs.
+                             not supported with return_noisy_conc_itters
+        :param screen_tolerance: float, percent, the analytic power must be <= screen_tolerance or
+                                 >= 100 - screen_tolerance to skip the simulation (only used if screen_power)
+        :param screen_approximate: bool, if True (and screen_power) the mann-kendall modes are also screened by their
+                                   approximate analytic power (normal approximation with an approximate variance of
+                                   S, see _analytic_mann_kendall_power), which is a point estimate rather than a bound
+                                   so runs near the thresholds may be misclassified.  Default False (the mann-kendall
+                                   modes are simulated)
+        :param result_cache_path: None or path to a sqlite file, if not None then the results of
+                                  mulitprocess_power_calcs are cached on disk keyed by a hash of every input that
+                                  affects the result (run values, calculator options affecting results, package
+                                  version), cached runs are not re-run. Hit/miss statistics are kept in
+                                  self.result_cache.stats.  Note that function options (e.g. a callable
+                                  mpmk_check_step) are keyed by their repr so are only cached within a session.
+        :param result_cache_max_entries: None or int, maximum number of cached results, the least recently used
+                                         results are evicted
+        :param result_cache_max_age_days: None or float, cached results older than this are evicted
         """
+        # stored to key the result cache
+        self._init_kwargs = {k: v for k, v in locals().items() if k != 'self'}
         assert print_freq is None or isinstance(print_freq, int), 'print_freq must be None or an integer'
         self.print_freq = print_freq
         assert significance_mode in self.implemented_significance_modes, (f'significance_mode {significance_mode} not '
                                                                           f'implemented, must be one of '
                                                                           f'{self.implemented_significance_modes}')
         self.nsims_pettitt = nsims_pettit
+        self.pettitt_null_seed = pettitt_null_seed
+        if pettitt_null_cache_dir is not None:
+            pettitt_null_cache_dir = Path(pettitt_null_cache_dir)
+        self.pettitt_null_cache_dir = pettitt_null_cache_dir
+        self.pettitt_sequential = pettitt_sequential
+        self.pettitt_sequential_error = pettitt_sequential_error
+        self._test_counters = {}
         if significance_mode in ['linear-regression', 'linear-regression-from-max', 'linear-regression-from-min',
                                  'mann-kendall', 'mann-kendall-from-max', 'mann-kendall-from-min']:
             assert expect_slope in ['auto', 1, -1], 'expect_slope must be "auto", 1, or -1'
@@ -176,39 +258,40 @@ class DetectionPowerCalculator:
 
         self._power_from_max = False
         self._power_from_min = False
+        self.analytic_power_test = None
+        self.screen_power_test = None
         if significance_mode == 'linear-regression':
             self.power_test = self._power_test_lr
+            self.analytic_power_test = self._analytic_power_lr
+            self.screen_power_test = self._screen_bounds_lr
         elif significance_mode == 'linear-regression-from-max':
             self._power_from_max = True
             self.power_test = self._power_test_lr
+            self.analytic_power_test = self._analytic_power_lr
+            self.screen_power_test = self._screen_bounds_lr
         elif significance_mode == 'linear-regression-from-min':
             self._power_from_min = True
             self.power_test = self._power_test_lr
+            self.analytic_power_test = self._analytic_power_lr
+            self.screen_power_test = self._screen_bounds_lr
         elif significance_mode == 'mann-kendall':
-            assert kendal_imported, (
-                'cannot run mann-kendall test, kendall_stats not installed'
-                'to install run:\n'
-                'pip install git+https://github.com/Komanawa-Solutions-Ltd/kendall_multipart_kendall.git')
             self.power_test = self._power_test_mann_kendall
+            self.analytic_power_test = self._analytic_power_mann_kendall
+            if screen_approximate:
+                self.screen_power_test = self._screen_bounds_mann_kendall
         elif significance_mode == 'mann-kendall-from-max':
             self._power_from_max = True
-            assert kendal_imported, (
-                'cannot run mann-kendall test, kendall_stats not installed'
-                'to install run:\n'
-                'pip install git+https://github.com/Komanawa-Solutions-Ltd/kendall_multipart_kendall.git')
             self.power_test = self._power_test_mann_kendall
+            self.analytic_power_test = self._analytic_power_mann_kendall
+            if screen_approximate:
+                self.screen_power_test = self._screen_bounds_mann_kendall
         elif significance_mode == 'mann-kendall-from-min':
             self._power_from_min = True
-            assert kendal_imported, (
-                'cannot run mann-kendall test, kendall_stats not installed'
-                'to install run:\n'
-                'pip install git+https://github.com/Komanawa-Solutions-Ltd/kendall_multipart_kendall.git')
             self.power_test = self._power_test_mann_kendall
+            self.analytic_power_test = self._analytic_power_mann_kendall
+            if screen_approximate:
+                self.screen_power_test = self._screen_bounds_mann_kendall
         elif significance_mode == 'n-section-mann-kendall':
-            assert kendal_imported, (
-                'cannot run mann-kendall test, kendall_stats not installed'
-                'to install run:\n'
-                'pip install git+https://github.com/Komanawa-Solutions-Ltd/kendall_multipart_kendall.git')
             assert isinstance(nparts, int), 'nparts must be an integer'
             assert nparts > 1, 'nparts must be greater than 1'
             self.kendall_mp_nparts = nparts
@@ -243,15 +326,15 @@ class DetectionPowerCalculator:
             self.mpmk_window = mpmk_window
             self.power_test = self._power_test_mp_kendall
         elif significance_mode == 'pettitt-test':
-            assert pyhomogeneity_imported, (
-                'cannot run pettitt test, pyhomogeneity not installed'
-                'to install run:\n'
-                'pip install pyhomogeneity')
             assert isinstance(nsims_pettit, int), 'nsims_pettit must be an integer'
+            assert nsims_pettit > 0, 'nsims_pettit must be greater than 0'
+            assert isinstance(pettitt_null_seed, int), 'pettitt_null_seed must be an integer'
+            assert isinstance(pettitt_sequential, bool), 'pettitt_sequential must be a boolean'
+            assert 0 < pettitt_sequential_error < 1, 'pettitt_sequential_error must be between 0 and 1'
+            if pettitt_null_cache_dir is not None:
+                pettitt_null_cache_dir.mkdir(parents=True, exist_ok=True)
             assert isinstance(efficent_mode, bool), 'efficent_mode must be a boolean'
-            if efficent_mode:
-                warnings.warn('efficent_mode not implemented for pettitt test, setting efficent_mode=False')
-            self.efficent_mode = False  # TODO long term fix this if needed
+            self.efficent_mode = efficent_mode
             self.power_test = self._power_test_pettitt
         else:
             raise NotImplementedError(f'significance_mode {significance_mode} not implemented, shouldnt get here')
@@ -260,6 +343,41 @@ class DetectionPowerCalculator:
 
         assert isinstance(nsims, int), 'nsims must be an integer'
         self.nsims = nsims
+        assert isinstance(analytic_power, bool), 'analytic_power must be a boolean'
+        self.analytic_power = analytic_power
+        if analytic_power:
+            assert self.analytic_power_test is not None, (f'analytic_power is not available for '
+                                                          f'{significance_mode=}')
+            assert return_noisy_conc_itters == 0, 'return_noisy_conc_itters is not supported with analytic_power'
+            assert not adaptive_nsims, 'adaptive_nsims is not supported with analytic_power'
+        assert isinstance(screen_power, bool), 'screen_power must be a boolean'
+        self.screen_power = screen_power
+        if screen_power:
+            assert self.analytic_power_test is not None, f'screen_power is not available for {significance_mode=}'
+            assert not analytic_power, 'screen_power is not needed with analytic_power'
+            assert return_noisy_conc_itters == 0, 'return_noisy_conc_itters is not supported with screen_power'
+            assert 0 <= screen_tolerance < 50, 'screen_tolerance must be between 0 and 50'
+        self.screen_tolerance = screen_tolerance
+        assert isinstance(screen_approximate, bool), 'screen_approximate must be a boolean'
+        self.screen_approximate = screen_approximate
+        self.screen_counts = {'analytic_0': 0, 'analytic_100': 0, 'efficient_mode': 0, 'simulated': 0, 'cached': 0,
+                              'checkpoint': 0}
+        self.result_cache = None
+        if result_cache_path is not None:
+            self.result_cache = _PowerResultCache(result_cache_path, max_entries=result_cache_max_entries,
+                                                  max_age_days=result_cache_max_age_days)
+        assert isinstance(adaptive_nsims, bool), 'adaptive_nsims must be a boolean'
+        self.adaptive_nsims = adaptive_nsims
+        if adaptive_nsims:
+            assert isinstance(adaptive_block, int) and adaptive_block > 0, 'adaptive_block must be a positive integer'
+            assert adaptive_ci_width > 0, 'adaptive_ci_width must be greater than 0'
+            assert adaptive_threshold is None or 0 < adaptive_threshold < 100, ('adaptive_threshold must be None or '
+                                                                                'between 0 and 100')
+            assert 0 < adaptive_confidence < 1, 'adaptive_confidence must be between 0 and 1'
+        self.adaptive_block = adaptive_block
+        self.adaptive_ci_width = adaptive_ci_width
+        self.adaptive_threshold = adaptive_threshold
+        self.adaptive_confidence = adaptive_confidence
         assert isinstance(min_samples, int), 'min_samples must be an integer'
         assert min_samples >= 3, ('min_samples must be at least 3 otherwise the slope regresion will either'
                                   'fail or be meaningless')
@@ -297,6 +415,10 @@ class DetectionPowerCalculator:
                     ls='--', label='regression, p={:.3f}'.format(o2.pvalue))
 
         elif self.significance_mode in ['mann-kendall', 'mann-kendall-from-max', 'mann-kendall-from-min']:
+            assert kendal_imported, (
+                'cannot plot mann-kendall test, kendall_stats not installed'
+                'to install run:\n'
+                'pip install git+https://github.com/Komanawa-Solutions-Ltd/kendall_multipart_kendall.git')
             if self._power_from_max:
                 istart = np.argmax(true_conc)
             elif self._power_from_min:
@@ -305,6 +427,10 @@ class DetectionPowerCalculator:
             mk.plot_data(ax=ax)
 
         elif self.significance_mode == 'n-section-mann-kendall':
+            assert kendal_imported, (
+                'cannot plot n-section-mann-kendall test, kendall_stats not installed'
+                'to install run:\n'
+                'pip install git+https://github.com/Komanawa-Solutions-Ltd/kendall_multipart_kendall.git')
             mpmk = MultiPartKendall(data=y0, nparts=self.kendall_mp_nparts,
                                     expect_part=self.expect_slope, min_size=self.kendall_mp_min_part_size,
                                     alpha=self.min_p_value, no_trend_alpha=self.kendall_mp_no_trend_alpha)
@@ -314,9 +440,10 @@ class DetectionPowerCalculator:
             else:
                 mpmk.plot_data_from_breakpoints(bp, ax=ax)
         elif self.significance_mode == 'pettitt-test':
-            h, cp, p, U, mu = pettitt_test(y0, alpha=self.min_p_value,
-                                           sim=self.nsims_pettitt)
-            p = round(p, 3)
+            null_k = _get_pettitt_null(len(y0), self.nsims_pettitt, self.pettitt_null_seed,
+                                       self.pettitt_null_cache_dir)
+            k, cp, p = _batch_pettitt(np.atleast_2d(y0), null_k)
+            cp, p = cp[0], round(p[0], 3)
             ax.axvline(x=cp, color='r', label=f'change_point, {p=}')
         else:
             raise ValueError(f'unknown significance_mode {self.significance_mode}, should not get here')
@@ -359,14 +486,7 @@ class DetectionPowerCalculator:
         :param return_extras: return extra variables for debugging
         :return: true timeseries, max_conc, max_conc_time, frac_p2
         """
-        mrt, mrt_p2 = check_age_inputs(mrt=mrt, mrt_p1=mrt_p1, mrt_p2=None, frac_p1=frac_p1,
-                                       precision=precision, f_p1=f_p1, f_p2=f_p2)
-        # make cdf of age
-        age_step, ages, age_fractions = make_age_dist(mrt, mrt_p1, mrt_p2, frac_p1, precision, f_p1, f_p2, start=np.nan)
-
-        ages = np.arange(0, np.nanmax([mrt_p1, mrt_p2]) * 5, age_step).round(precision)  # approximately monthly steps
-        age_cdf = binary_exp_piston_flow_cdf(ages, mrt_p1, mrt_p2, frac_p1, f_p1, f_p2)
-        age_fractions = np.diff(age_cdf, prepend=0)
+        mrt, mrt_p2, age_step, ages, age_fractions = _bepfm_age_dist(mrt, mrt_p1, frac_p1, f_p1, f_p2, precision)
 
         # make historical source concentrations from prev_slope, initial_conc, max_conc
         if past_source_data is not None:
@@ -573,8 +693,55 @@ class DetectionPowerCalculator:
                     'noisy_conc' : noisy_conc_ts, if self.return_noisy_conc_itters > 0
                     ]
         """
-        if testnitter is not None:
-            warnings.warn('testnitter is expected to be None unless you are testing run times')
+        self._check_power_calc_inputs(
+            mrt_model=mrt_model,
+            samp_years=samp_years,
+            samp_per_year=samp_per_year,
+            implementation_time=implementation_time,
+            initial_conc=initial_conc,
+            target_conc=target_conc,
+            prev_slope=prev_slope,
+            max_conc=max_conc,
+            min_conc=min_conc,
+            mrt_p1=mrt_p1,
+            frac_p1=frac_p1,
+            f_p1=f_p1,
+            f_p2=f_p2,
+            true_conc_ts=true_conc_ts,
+        )
+        out = self._power_calc(
+            idv=idv,
+            error=error,
+            mrt_model=mrt_model,
+            samp_years=samp_years,
+            samp_per_year=samp_per_year,
+            implementation_time=implementation_time,
+            initial_conc=initial_conc,
+            target_conc=target_conc,
+            prev_slope=prev_slope,
+            max_conc=max_conc,
+            min_conc=min_conc,
+            mrt=mrt,
+            mrt_p1=mrt_p1,
+            frac_p1=frac_p1,
+            f_p1=f_p1,
+            f_p2=f_p2,
+            true_conc_ts=true_conc_ts,
+            seed=seed,
+            testnitter=testnitter,
+        )
+        if isinstance(out.get('power'), dict):  # with the true and/or noisy concentrations
+            out['power'] = pd.Series(out['power'])
+        else:
+            out = pd.Series(out)
+        return out
+
+    def _check_power_calc_inputs(self, mrt_model, samp_years=None, samp_per_year=None, implementation_time=None,
+                                 initial_conc=None, target_conc=None, prev_slope=None, max_conc=None, min_conc=None,
+                                 mrt_p1=None, frac_p1=None, f_p1=None, f_p2=None, true_conc_ts=None, **kwargs):
+        """
+        check the inputs of power_calc (see power_calc), other kwargs are ignored
+        """
         assert mrt_model in self.implemented_mrt_models, f'mrt_model must be one of: {self.implemented_mrt_models}'
         if mrt_model != 'pass_true_conc':
             assert pd.api.types.is_integer(
@@ -590,13 +757,67 @@ class DetectionPowerCalculator:
             assert max_conc >= target_conc, 'max_conc must be greater than or equal to target_conc'
             assert pd.api.types.is_integer(implementation_time)
 
+        if mrt_model == 'piston_flow':
+            assert true_conc_ts is None, 'true_conc_ts must be None for piston_flow model'
+        elif mrt_model == 'binary_exponential_piston_flow':
+            assert age_tools_imported, (
+                'cannot run binary_exponential_piston_flow model, age_tools not installed'
+                'to install run:\n'
+                'pip install git+https://github.com/Komanawa-Solutions-Ltd/gw_age_tools')
+            assert true_conc_ts is None, 'true_conc_ts must be None for binary_exponential_piston_flow model'
+            tvs = ['mrt_p1', 'frac_p1', 'f_p1', 'f_p2', 'min_conc']
+            bad = []
+            for t in tvs:
+                if eval(t) is None:
+                    bad.append(t)
+            if len(bad) > 0:
+                raise ValueError(f'for binary_exponential_piston_flow model the following must be specified: {bad}')
+        elif mrt_model == 'pass_true_conc':
+            assert true_conc_ts is not None, 'true_conc_ts must be specified for pass_true_conc model'
+            none_params = [
+                'samp_years', 'samp_per_year', 'implementation_time', 'initial_conc', 'target_conc', 'prev_slope',
+                'max_conc', 'min_conc', 'mrt_p1', 'frac_p1', 'f_p1', 'f_p2',
+            ]
+            for k in none_params:
+                assert eval(k) is None, f'{k} must be None for pass_true_conc model'
+
+    def _power_calc(self,
+                    idv,
+                    error: float,
+                    mrt_model: str,
+                    samp_years: {int, None} = None,
+                    samp_per_year: {int, None} = None,
+                    implementation_time: {int, None} = None,
+                    initial_conc: {float, None} = None,
+                    target_conc: {float, None} = None,
+                    prev_slope: {float, None} = None,
+                    max_conc: {float, None} = None,
+                    min_conc: {float, None} = None,
+                    mrt: {float, None} = None,
+                    # options for binary_exponential_piston_flow model
+                    mrt_p1: {float, None} = None,
+                    frac_p1: {float, None} = None,
+                    f_p1: {float, None} = None,
+                    f_p2: {float, None} = None,
+                    # options for the pass_true_conc_ts model
+                    true_conc_ts: {np.ndarray, None} = None,
+                    seed: {int, None} = 5585,
+                    testnitter=None,
+                    ):
+        """
+        see power_calc, returns the power results as a dictionary rather than a pd.Series.  The inputs are not
+        checked (see _check_power_calc_inputs), this is the pre-validated entry point used by
+        mulitprocess_power_calcs which validates the whole batch at once
+        """
+        if testnitter is not None:
+            warnings.warn('testnitter is expected to be None unless you are testing run times')
+
         # mange lag
         if mrt_model == 'piston_flow':
             if self.significance_mode == 'pettitt-test':
                 warnings.warn('using the Pettitt test with lagged data can cause some weird results, we do'
                               'not recommend using this combination')
 
-            assert true_conc_ts is None, 'true_conc_ts must be None for piston_flow model'
             true_conc_ts, max_conc_val, max_conc_time, mrt_p2 = self.truets_from_piston_flow(mrt,
                                                                                              initial_conc, target_conc,
                                                                                              prev_slope, max_conc,
@@ -610,19 +831,6 @@ class DetectionPowerCalculator:
             if self.significance_mode == 'pettitt-test':
                 warnings.warn('using the Pettitt test with lagged data can cause some weird results, we do'
                               'not recommend using this combination')
-            assert age_tools_imported, (
-                'cannot run binary_exponential_piston_flow model, age_tools not installed'
-                'to install run:\n'
-                'pip install git+https://github.com/Komanawa-Solutions-Ltd/gw_age_tools')
-            assert true_conc_ts is None, 'true_conc_ts must be None for binary_exponential_piston_flow model'
-            tvs = ['mrt_p1', 'frac_p1', 'f_p1', 'f_p2', 'min_conc']
-            bad = []
-            for t in tvs:
-                if eval(t) is None:
-                    bad.append(t)
-            if len(bad) > 0:
-                raise ValueError(f'for binary_exponential_piston_flow model the following must be specified: {bad}')
-
             (true_conc_ts, max_conc_val,
              max_conc_time, mrt_p2) = self.truets_from_binary_exp_piston_flow(
                 mrt, mrt_p1, frac_p1, f_p1, f_p2,
@@ -634,13 +842,6 @@ class DetectionPowerCalculator:
             else:
                 expect_slope = self.expect_slope
         elif mrt_model == 'pass_true_conc':
-            assert true_conc_ts is not None, 'true_conc_ts must be specified for pass_true_conc model'
-            none_params = [
-                'samp_years', 'samp_per_year', 'implementation_time', 'initial_conc', 'target_conc', 'prev_slope',
-                'max_conc', 'min_conc', 'mrt_p1', 'frac_p1', 'f_p1', 'f_p2',
-            ]
-            for k in none_params:
-                assert eval(k) is None, f'{k} must be None for pass_true_conc model'
             max_conc_val = np.max(true_conc_ts)
             max_conc_time = None
             mrt_p2 = None
@@ -660,51 +861,107 @@ class DetectionPowerCalculator:
         if nsamples < self.min_samples:
             raise ValueError(f'nsamples must be greater than {self.min_samples}, you can change the '
                              f'minimum number of samples in the DetectionPowerCalculator class init')
-        # tile to nsims
         if testnitter is not None:
-            rand_shape = (testnitter, nsamples)
-            conc_with_noise = np.tile(true_conc_ts, testnitter).reshape(rand_shape)
+            max_nsims = testnitter
+        else:
+            max_nsims = self.nsims
+        if self.adaptive_nsims:
+            block_size = self.adaptive_block
+            ci_z = stats.norm.ppf(1 - (1 - self.adaptive_confidence) / 2)
         else:
-            rand_shape = (self.nsims, nsamples)
-            conc_with_noise = np.tile(true_conc_ts, self.nsims).reshape(rand_shape)
+            block_size = max_nsims
 
-        # generate noise
+        # seed the noise, drawing the noise in blocks gives the same noise as a single draw
         np.random.seed(seed)
         all_seeds = list(np.random.randint(21, 54762438, 2))
         np.random.seed(all_seeds.pop(0))
-        noise = np.random.normal(0, error, rand_shape)
-        conc_with_noise += noise
-
-        # run slope test
-        power, significant = self.power_test(idv, conc_with_noise,
-                                             expected_slope=expect_slope,  # just used for sign
-                                             imax=np.argmax(true_conc_ts), imin=np.argmin(true_conc_ts),
-                                             true_data=true_conc_ts,
-                                             return_slope=False)
-
-        out = pd.Series({'idv': idv,
-                         'power': power,
-                         'max_conc': max_conc_val,
-                         'max_conc_time': max_conc_time,
-                         'error': error,
-                         'mrt_model': mrt_model,
-                         'samp_years': samp_years,
-                         'samp_per_year': samp_per_year,
-                         'implementation_time': implementation_time,
-                         'initial_conc': initial_conc,
-                         'target_conc': target_conc,
-                         'previous_slope': prev_slope,
-                         'max_conc_lim': max_conc,
-                         'min_conc_lim': min_conc,
-                         'mrt': mrt,
-                         'mrt_p1': mrt_p1,
-                         'frac_p1': frac_p1,
-                         'f_p1': f_p1,
-                         'f_p2': f_p2,
-                         'seed': seed,
-                         'mrt_p2': mrt_p2,
-                         'python_error': None
-                         })
+
+        self._test_counters = {}
+        nsims_run = 0
+        noisy_blocks, significant_blocks = [], []
+        screen = None
+        if self.analytic_power:
+            power = self.analytic_power_test(true_conc_ts, error, expected_slope=expect_slope,
+                                             imax=np.argmax(true_conc_ts), imin=np.argmin(true_conc_ts))
+            max_nsims = 0  # no simulation
+        elif self.screen_power and self.screen_power_test is not None:
+            lower, upper = self.screen_power_test(true_conc_ts, error, expected_slope=expect_slope,
+                                                  imax=np.argmax(true_conc_ts), imin=np.argmin(true_conc_ts))
+            if upper <= self.screen_tolerance:
+                screen, power, max_nsims = 'analytic_0', 0., 0
+            elif lower >= 100 - self.screen_tolerance:
+                screen, power, max_nsims = 'analytic_100', 100., 0
+        while nsims_run < max_nsims:
+            # tile to block size and generate noise
+            nblock = min(block_size, max_nsims - nsims_run)
+            rand_shape = (nblock, nsamples)
+            conc_with_noise = np.tile(true_conc_ts, nblock).reshape(rand_shape)
+            noise = np.random.normal(0, error, rand_shape)
+            conc_with_noise += noise
+
+            # run slope test
+            power, significant = self.power_test(idv, conc_with_noise,
+                                                 expected_slope=expect_slope,  # just used for sign
+                                                 imax=np.argmax(true_conc_ts), imin=np.argmin(true_conc_ts),
+                                                 true_data=true_conc_ts,
+                                                 return_slope=False)
+            nsims_run += nblock
+            significant_blocks.append(significant)
+            if self.return_noisy_conc_itters > 0:
+                noisy_blocks.append(conc_with_noise)
+            if not self.adaptive_nsims:
+                break
+            power_lower, power_upper = _wilson_interval(np.sum([e.sum() for e in significant_blocks]), nsims_run,
+                                                        ci_z)
+            power_lower, power_upper = power_lower * 100, power_upper * 100
+            if power_upper - power_lower <= self.adaptive_ci_width:
+                break
+            if self.adaptive_threshold is not None and (power_lower > self.adaptive_threshold
+                                                        or power_upper < self.adaptive_threshold):
+                break
+
+        if self.adaptive_nsims:
+            if screen is not None:  # no simulations run
+                power_lower, power_upper = np.nan, np.nan
+            else:
+                significant = np.concatenate(significant_blocks)
+                power = significant.sum() / nsims_run * 100
+            self._test_counters.update({'nsims_run': nsims_run, 'power_lower': power_lower,
+                                        'power_upper': power_upper})
+        if self.screen_power:
+            if screen is None:
+                screen = 'efficient_mode' if self._test_counters.get('_efficient_mode_screened') else 'simulated'
+            self.screen_counts[screen] += 1
+            self._test_counters['screen'] = screen
+        if self.return_noisy_conc_itters > 0:
+            conc_with_noise = np.concatenate(noisy_blocks)
+
+        out = {'idv': idv,
+               'power': power,
+               'max_conc': max_conc_val,
+               'max_conc_time': max_conc_time,
+               'error': error,
+               'mrt_model': mrt_model,
+               'samp_years': samp_years,
+               'samp_per_year': samp_per_year,
+               'implementation_time': implementation_time,
+               'initial_conc': initial_conc,
+               'target_conc': target_conc,
+               'previous_slope': prev_slope,
+               'max_conc_lim': max_conc,
+               'min_conc_lim': min_conc,
+               'mrt': mrt,
+               'mrt_p1': mrt_p1,
+               'frac_p1': frac_p1,
+               'f_p1': f_p1,
+               'f_p2': f_p2,
+               'seed': seed,
+               'mrt_p2': mrt_p2,
+               'python_error': None
+               }
+        for key, val in self._test_counters.items():
+            if not key.startswith('_'):  # private keys are only used to accumulate counters across blocks
+                out[key] = val
         out_data = {}
         out_data['power'] = out
         if self.return_true_conc:
@@ -744,27 +1001,25 @@ class DetectionPowerCalculator:
                                                'raised here that means that the max concentration is too far along'
                                                f'the timeseries to be detected: {imax=}, {n_samples0}')
         x = np.arange(n_samples)
-        p_val = []
-        slopes = []
         if self.efficent_mode and not return_slope:
-            o2 = stats.linregress(x, true_data)
-            pval_bad = o2.pvalue > self.min_p_value
+            true_slope, true_stderr, true_pval = _batch_linregress(x, np.atleast_2d(true_data))
+            pval_bad = not true_pval[0] <= self.min_p_value
             sign_bad = False
             if expected_slope is not None:
-                sign_bad = np.sign(o2.slope) != np.sign(expected_slope)
+                sign_bad = np.sign(true_slope[0]) != np.sign(expected_slope)
 
             if pval_bad or sign_bad:  # cannot reject null hypothesis on noise free data
+                self._test_counters['_efficient_mode_screened'] = True
                 return 0., np.zeros(n_sims, dtype=bool)
 
-        for i, y0 in enumerate(y):
+        # regressions are run as a single matrix operation, chunked only to respect print_freq
+        chunk_size = n_sims if self.print_freq is None else self.print_freq
+        slopes = np.full(n_sims, np.nan)
+        p_val = np.full(n_sims, np.nan)
+        for i in range(0, n_sims, max(chunk_size, 1)):
             if self.print_freq is not None:
-                if i % self.print_freq == 0:
-                    print(f'{idv} {i + 1} of {n_sims}')
-            o2 = stats.linregress(x, y0)
-            slopes.append(o2.slope)
-            p_val.append(o2.pvalue)
-        p_val = np.array(p_val)
-        slopes = np.array(slopes)
+                print(f'{idv} {i + 1} of {n_sims}')
+            slopes[i:i + chunk_size], _, p_val[i:i + chunk_size] = _batch_linregress(x, y[i:i + chunk_size])
         p_list = p_val < self.min_p_value
         if expected_slope is not None:
             sign_corr = np.sign(slopes) == np.sign(expected_slope)
@@ -801,25 +1056,25 @@ class DetectionPowerCalculator:
                                                f'the timeseries to be detected: {imax=}, {n_samples0}')
 
         if self.efficent_mode and not return_slope:
-            mk = MannKendall(data=true_data, alpha=self.min_p_value)
-            pval_bad = mk.p > self.min_p_value
+            true_trend, h, true_p, z, s, var_s = _batch_mann_kendall(np.atleast_2d(true_data), self.min_p_value)
+            pval_bad = not true_p[0] <= self.min_p_value
             sign_bad = False
             if expected_slope is not None:
-                sign_bad = np.sign(mk.trend) != np.sign(expected_slope)
+                sign_bad = np.sign(true_trend[0]) != np.sign(expected_slope)
             if pval_bad or sign_bad:  # cannot reject null hypothesis on noise free data
+                self._test_counters['_efficient_mode_screened'] = True
                 return 0., np.zeros(n_sims, dtype=bool)
 
-        p_val = []
-        slopes = []
-        for i, y0 in enumerate(y):
+        # mann kendall tests are run as a batch, chunked only to respect print_freq
+        chunk_size = n_sims if self.print_freq is None else self.print_freq
+        slopes = np.zeros(n_sims, dtype=int)
+        p_val = np.full(n_sims, np.nan)
+        for i in range(0, n_sims, max(chunk_size, 1)):
             if self.print_freq is not None:
-                if i % self.print_freq == 0:
-                    print(f'{idv} {i + 1} of {n_sims}')
-            mk = MannKendall(data=y0, alpha=self.min_p_value)
-            slopes.append(mk.trend)
-            p_val.append(mk.p)
-        p_val = np.array(p_val)
-        slopes = np.array(slopes)
+                print(f'{idv} {i + 1} of {n_sims}')
+            trend, h, p, z, s, var_s = _batch_mann_kendall(y[i:i + chunk_size], self.min_p_value)
+            slopes[i:i + chunk_size] = trend
+            p_val[i:i + chunk_size] = p
         p_list = p_val < self.min_p_value
         if expected_slope is not None:
             sign_corr = np.sign(slopes) == np.sign(expected_slope)
@@ -831,6 +1086,69 @@ class DetectionPowerCalculator:
             return power, p_list, slope_out
         return power, p_list
 
+    def _analytic_power_lr(self, true_data, error, expected_slope, imax, imin):
+        """
+        analytic power of the linear regression test (slope is significant and in the correct direction) for gaussian
+        noise with standard deviation error, see _analytic_linregress_power
+        :param true_data: noise free concentration data
+        :param error: standard deviation of the noise
+        :param expected_slope: used to determine sign of slope predicted is same as expected
+        :param imax: index of the maximum concentration
+        :param imin: index of the minimum concentration
+        :return: power (percent 0-100)
+        """
+        true_data = self._analytic_test_data(true_data, imax, imin)
+        return _analytic_linregress_power(true_data, error, self.min_p_value, expected_slope) * 100
+
+    def _analytic_power_mann_kendall(self, true_data, error, expected_slope, imax, imin):
+        """
+        approximate analytic power of the mann kendall test (trend is significant and in the correct direction) for
+        gaussian noise with standard deviation error, see _analytic_mann_kendall_power
+        :param true_data: noise free concentration data
+        :param error: standard deviation of the noise
+        :param expected_slope: used to determine sign of trend predicted is same as expected
+        :param imax: index of the maximum concentration
+        :param imin: index of the minimum concentration
+        :return: power (percent 0-100)
+        """
+        true_data = self._analytic_test_data(true_data, imax, imin)
+        return _analytic_mann_kendall_power(true_data, error, self.min_p_value, expected_slope) * 100
+
+    def _screen_bounds_lr(self, true_data, error, expected_slope, imax, imin):
+        """
+        conservative bounds of the linear regression power for screen_power, see _analytic_linregress_power_bounds
+        :return: lower, upper (percent 0-100)
+        """
+        true_data = self._analytic_test_data(true_data, imax, imin)
+        lower, upper = _analytic_linregress_power_bounds(true_data, error, self.min_p_value, expected_slope)
+        return lower * 100, upper * 100
+
+    def _screen_bounds_mann_kendall(self, true_data, error, expected_slope, imax, imin):
+        """
+        the approximate mann kendall power as both bounds for screen_power (only used if screen_approximate)
+        :return: lower, upper (percent 0-100)
+        """
+        power = self._analytic_power_mann_kendall(true_data, error, expected_slope, imax, imin)
+        return power, power
+
+    def _analytic_test_data(self, true_data, imax, imin):
+        """
+        the noise free data used by the analytic power tests (from the max/min if required)
+        :param true_data: noise free concentration data
+        :param imax: index of the maximum concentration
+        :param imin: index of the minimum concentration
+        :return:
+        """
+        n_samples0 = len(true_data)
+        if self._power_from_max:
+            true_data = true_data[imax:]
+        if self._power_from_min:
+            true_data = true_data[imin:]
+        assert len(true_data) >= self.min_samples, ('n_samples must be greater than min_samples, '
+                                                    'raised here that means that the max concentration is too far along'
+                                                    f'the timeseries to be detected: {imax=}, {n_samples0}')
+        return true_data
+
     def _power_test_pettitt(self, idv, y, expected_slope, imax, imin, true_data, return_slope=False):
         """
 
@@ -838,23 +1156,51 @@ class DetectionPowerCalculator:
         :param expected_slope: not used
         :param imax: not used
         :param imin: not used
+        :param true_data: noise free data, used for the efficent_mode check
         :param return_slope: not really used, dummy
         :return:
         """
         n_sims, n_samples = y.shape
         assert n_samples >= self.min_samples, ('n_samples must be greater than min_samples')
-        num_pass = 0
-        passed = []
-        for i, y0 in enumerate(y):
+        null_kwargs = dict(n_samples=n_samples, nsims=self.nsims_pettitt, seed=self.pettitt_null_seed,
+                           cache_dir=self.pettitt_null_cache_dir)
+        null_k = None
+        if not self.pettitt_sequential:
+            null_k = _get_pettitt_null(**null_kwargs)
+        if self.efficent_mode and not return_slope:
+            true_k, _, _ = _batch_pettitt(np.atleast_2d(true_data))
+            if self.pettitt_sequential:
+                true_p = _sequential_pettitt_pvalue(true_k, alpha=self.min_p_value,
+                                                    error=self.pettitt_sequential_error, **null_kwargs)[0][0]
+            else:
+                true_p = _pettitt_null_pvalue(null_k, true_k[0])
+            if true_p >= self.min_p_value:  # cannot reject null hypothesis on noise free data
+                self._test_counters['_efficient_mode_screened'] = True
+                return 0., np.zeros(n_sims, dtype=bool)
+
+        # tests are run as a single matrix operation, chunked only to respect print_freq
+        chunk_size = n_sims if self.print_freq is None else self.print_freq
+        k = np.full(n_sims, np.nan)
+        p_val = np.full(n_sims, np.nan)
+        for i in range(0, n_sims, max(chunk_size, 1)):
             if self.print_freq is not None:
-                if i % self.print_freq == 0:
-                    print(f'{idv} {i + 1} of {n_sims}')
-            h, cp, p, U, mu = pettitt_test(y0, alpha=self.min_p_value,
-                                           sim=self.nsims_pettitt)
-            num_pass += h
-            passed.append(h)
-        passed = np.atleast_1d(passed)
-        power = num_pass / n_sims * 100
+                print(f'{idv} {i + 1} of {n_sims}')
+            if self.pettitt_sequential:
+                k[i:i + chunk_size], _, _ = _batch_pettitt(y[i:i + chunk_size])
+            else:
+                _, _, p_val[i:i + chunk_size] = _batch_pettitt(y[i:i + chunk_size], null_k)
+        if self.pettitt_sequential:
+            p_val, nperms, ngenerated = _sequential_pettitt_pvalue(k, alpha=self.min_p_value,
+                                                                   error=self.pettitt_sequential_error, **null_kwargs)
+            # accumulated as power_calc may run the noisy simulations in blocks (adaptive_nsims), the null is shared
+            # by the blocks so the permutations generated is the largest null used
+            total = self._test_counters.get('_pettitt_compared', 0) + nperms.sum()
+            nseries = self._test_counters.get('_pettitt_nseries', 0) + len(nperms)
+            generated = max(self._test_counters.get('pettitt_perms_generated', 0), ngenerated)
+            self._test_counters.update({'pettitt_perms_generated': generated, 'pettitt_perms_mean': total / nseries,
+                                        '_pettitt_compared': total, '_pettitt_nseries': nseries})
+        passed = self.min_p_value > p_val
+        power = passed.sum() / n_sims * 100
         if return_slope:
             return power, passed, None
         return power, passed
@@ -882,12 +1228,14 @@ class DetectionPowerCalculator:
         power = []
         window = None
         if self.efficent_mode:
-            mpmk = MultiPartKendall(data=true_data, nparts=self.kendall_mp_nparts,
-                                    expect_part=expected_slope, min_size=self.kendall_mp_min_part_size,
-                                    alpha=self.min_p_value, no_trend_alpha=self.kendall_mp_no_trend_alpha,
-                                    check_step=use_check_step, check_window=None)
-            best = mpmk.get_maxz_breakpoints(raise_on_none=False)
+            true_candidates = _mpmk_candidate_breakpoints(n_samples, self.kendall_mp_min_part_size,
+                                                          self.kendall_mp_nparts, use_check_step, check_window=None)
+            mpmk = _SegmentMannKendall(true_data, true_candidates, alpha=self.min_p_value,
+                                       no_trend_alpha=self.kendall_mp_no_trend_alpha,
+                                       min_size=self.kendall_mp_min_part_size)
+            best = mpmk.get_maxz_breakpoints(expected_slope)
             if best is None:  # no matches on the True data not worth running the power calc
+                self._test_counters['_efficient_mode_screened'] = True
                 return 0., np.zeros(n_sims, dtype=bool)
 
             if len(best) > 1:
@@ -907,15 +1255,16 @@ class DetectionPowerCalculator:
                                bp + delta)
                     window.append((wmin, wmax))
 
+        candidates = _mpmk_candidate_breakpoints(n_samples, self.kendall_mp_min_part_size, self.kendall_mp_nparts,
+                                                 use_check_step, check_window=window)
         for i, y0 in enumerate(y):
             if self.print_freq is not None:
                 if i % self.print_freq == 0:
                     print(f'{idv} {i + 1} of {n_sims}')
-            mpmk = MultiPartKendall(data=y0, nparts=self.kendall_mp_nparts,
-                                    expect_part=expected_slope, min_size=self.kendall_mp_min_part_size,
-                                    alpha=self.min_p_value, no_trend_alpha=self.kendall_mp_no_trend_alpha,
-                                    check_step=use_check_step, check_window=window)
-            power.append(mpmk.acceptable_matches.any())
+            mpmk = _SegmentMannKendall(y0, candidates, alpha=self.min_p_value,
+                                       no_trend_alpha=self.kendall_mp_no_trend_alpha,
+                                       min_size=self.kendall_mp_min_part_size)
+            power.append(mpmk.any_acceptable(expected_slope))
 
         power_array = np.array(power)
         power_out = power_array.sum() / n_sims * 100
@@ -923,14 +1272,32 @@ class DetectionPowerCalculator:
             return power_out, power_array, None
         return power_out, power_array
 
+    def _worker_copy(self):
+        """
+        copy of the calculator as configured (including any attributes set after construction and the state of
+        subclasses) for the multiprocessing workers, without the result cache (which is only read and written by
+        the main process) and with fresh counters
+        :return: DetectionPowerCalculator (same class as self)
+        """
+        worker = copy.copy(self)
+        worker.result_cache = None
+        worker.screen_counts = dict.fromkeys(self.screen_counts, 0)
+        worker._test_counters = {}
+        return worker
+
     def _power_calc_mp(self, kwargs):
         """
         multiprocessing wrapper for power_calc
-        :param kwargs:
-        :return:
+        :param kwargs: kwargs for power_calc and trusted (bool), if trusted the inputs have already been validated
+                       (see mulitprocess_power_calcs) and are not checked again
+        :return: dict of the power results (or the python_error and kwargs)
         """
+        kwargs = dict(kwargs)
+        trusted = kwargs.pop('trusted', False)
         try:
-            out = self.power_calc(**kwargs)
+            if not trusted:
+                self._check_power_calc_inputs(**kwargs)
+            out = self._power_calc(**kwargs)
             if self.return_true_conc or self.return_noisy_conc_itters > 0:
                 out = out['power']
         except Exception:
@@ -943,9 +1310,59 @@ class DetectionPowerCalculator:
             for k in kwargs:
                 if k not in ['true_conc_ts', 'idv']:
                     out[k] = kwargs[k]
-        out = pd.Series(out)
         return out
 
+    def _power_calc_batch(self, runs):
+        """
+        multiprocessing wrapper for a batch of power_calc runs, one task (and one returned block) per batch keeps the
+        pickling and IPC overhead small for the cheap significance tests
+        :param runs: list of kwargs for power_calc
+        :return: pd.DataFrame with one row per run (see _typed_results)
+        """
+        n = len(runs)
+        columns = {}
+        # columns that only held integers (or bools) in every row keep that dtype, as pd.DataFrame would give
+        int_columns, bool_columns = set(), set()
+        for i, kwargs in enumerate(runs):
+            out = self._power_calc_mp(kwargs)
+            if i > 0:
+                int_columns.intersection_update(out)
+                bool_columns.intersection_update(out)
+            for key, val in out.items():
+                col = columns.get(key)
+                if col is None:
+                    col = columns[key] = _new_result_column(key, val, n)
+                    if i == 0:
+                        (bool_columns if pd.api.types.is_bool(val) else int_columns).add(key)
+                if col.dtype != object and not _is_result_number(val):
+                    col = columns[key] = col.astype(object)
+                if not pd.api.types.is_integer(val):
+                    int_columns.discard(key)
+                if not pd.api.types.is_bool(val):
+                    bool_columns.discard(key)
+                col[i] = np.nan if val is None and col.dtype != object else val
+        for key, col in columns.items():
+            if key in int_columns or key in bool_columns:
+                columns[key] = col.astype(np.int64 if key in int_columns else bool)
+            elif col.dtype == object and key in _result_float_columns:
+                # a numeric column that held a non numeric value, coerced to NaN as before
+                columns[key] = pd.to_numeric(pd.Series(col).fillna(np.nan), errors='coerce').to_numpy()
+        return self._typed_results(pd.DataFrame(columns, index=pd.RangeIndex(n)))
+
+    def _typed_results(self, results):
+        """
+        give the result columns compact types: mrt_model as a categorical and the (possibly None) numeric inputs as
+        float, so blocks of results concatenate without object columns
+        :param results: pd.DataFrame of power_calc results
+        :return: pd.DataFrame
+        """
+        if 'mrt_model' in results.columns:
+            results['mrt_model'] = pd.Categorical(results['mrt_model'], categories=self.implemented_mrt_models)
+        for col in _result_float_columns:
+            if col in results.columns and results[col].dtype == object:
+                results[col] = pd.to_numeric(results[col].fillna(np.nan), errors='coerce')
+        return results
+
     @staticmethod
     def _get_id_str(val, name, float_percision=1):
         """
@@ -962,42 +1379,331 @@ class DetectionPowerCalculator:
                 return f'{name}={val:.{float_percision}f}'
             return f'{name}={val}'
 
+    @classmethod
+    def _get_id_codes(cls, vals, name, float_percision=1):
+        """
+        vectorised equivalent of _get_id_str for an array of values, each unique value is only formatted once
+        :param vals: np.array of values
+        :param name: name for _get_id_str
+        :param float_percision: float_percision for _get_id_str
+        :return: np.array of integer codes, equal codes <==> equal id strings
+        """
+        vals = np.atleast_1d(vals)
+        if vals.dtype == object:
+            is_none = np.equal(vals, None)
+            inferred = pd.api.types.infer_dtype(vals[~is_none], skipna=False)
+            if inferred in ('floating', 'integer', 'string', 'empty'):
+                # homogeneous values (other than None), the None values get the last code
+                codes = np.full(len(vals), -1)
+                if not is_none.all():
+                    use_dtype = {'floating': float, 'integer': int, 'string': str}[inferred]
+                    codes[~is_none] = cls._get_id_codes(vals[~is_none].astype(use_dtype), name, float_percision)
+                codes[is_none] = codes.max() + 1
+                return codes
+            # mixed types, (type, value) keys so that e.g. 1 and 1.0 (different id strings) are not merged
+            uniques = {}
+            inverse = np.array([uniques.setdefault((type(v), v), len(uniques)) for v in vals], dtype=int)
+            uniques = [v for t, v in uniques]
+        else:
+            inverse, uniques = pd.factorize(vals, use_na_sentinel=False)
+        id_strs = [cls._get_id_str(v, name, float_percision) for v in uniques]
+        str_codes, _ = pd.factorize(np.array(id_strs))
+        return str_codes[inverse]
+
+    @classmethod
+    def _get_conc_id_codes(cls, vals, name, canon_idx, float_percision=1, canon_percision=6):
+        """
+        _get_id_codes of a concentration column where the canonicalized rows (see mulitprocess_power_calcs
+        canonicalize) are condensed at canon_percision and the other rows at float_percision, the two sets of rows
+        never share a code
+        :param vals: np.array of values
+        :param name: name for _get_id_str
+        :param canon_idx: boolean array of the canonicalized rows
+        :param float_percision: float_percision of the rows that are not canonicalized
+        :param canon_percision: float_percision of the canonicalized rows
+        :return: np.array of integer codes
+        """
+        if not canon_idx.any():
+            return cls._get_id_codes(vals, name, float_percision)
+        codes = np.zeros(len(vals), dtype=np.int64)
+        codes[canon_idx] = cls._get_id_codes(vals[canon_idx], name, max(float_percision, canon_percision))
+        if not canon_idx.all():
+            codes[~canon_idx] = cls._get_id_codes(vals[~canon_idx], name, float_percision) + codes.max() + 1
+        return codes
+
+    def _result_cache_key(self, run, true_conc_digest=None):
+        """
+        hash of every input that affects the result of a run (see result_cache_path)
+        :param run: run kwargs for power_calc
+        :param true_conc_digest: None (computed from the run) or the digest (bytes or str) of the true concentration
+                                 time series of the run
+        :return: str hex digest
+        """
+        # options that do not change the power results
+        ignore = ('ncores', 'log_level', 'return_true_conc', 'return_noisy_conc_itters', 'only_significant_noisy',
+                  'print_freq', 'pettitt_null_cache_dir', 'result_cache_path', 'result_cache_max_entries',
+                  'result_cache_max_age_days')
+        config = {k: v for k, v in self._init_kwargs.items() if k not in ignore}
+        run = {k: v for k, v in run.items() if k not in ('idv', 'true_conc_idx', 'trusted')}
+        if run.get('true_conc_ts') is not None:
+            if true_conc_digest is None:
+                true_conc_digest = _true_conc_digest(run['true_conc_ts'])
+            run['true_conc_ts'] = true_conc_digest.hex() if isinstance(true_conc_digest, bytes) else true_conc_digest
+
+        def to_json(val):
+            if isinstance(val, np.generic):
+                return val.item()
+            if isinstance(val, np.ndarray):
+                return val.tolist()
+            return repr(val)
+
+        key = json.dumps([_package_version(), config, run], default=to_json, sort_keys=True)
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @staticmethod
+    def _get_true_conc_digests(true_conc_ts_vals, decimals=6):
+        """
+        digest of each passed true concentration time series, the digests of a RaggedTrueConc are taken from the
+        collection if it holds them (see RaggedTrueConc.compute_digests) so an on disk store is not read here
+        :param true_conc_ts_vals: array of true concentration time series (or None) or RaggedTrueConc
+        :param decimals: number of decimals to round the series to before hashing
+        :return: list of bytes (None for no series), or None for an on disk RaggedTrueConc without digests
+        """
+        if isinstance(true_conc_ts_vals, RaggedTrueConc) and decimals == _true_conc_decimals:
+            if true_conc_ts_vals.digests is not None:
+                return [true_conc_ts_vals.series_digest(i) for i in range(len(true_conc_ts_vals))]
+            if true_conc_ts_vals.path is not None:
+                return None
+        return [None if ts is None else _true_conc_digest(ts, decimals) for ts in true_conc_ts_vals]
+
+    @staticmethod
+    def _get_true_conc_codes(true_conc_ts_vals, decimals=6, digests=None):
+        """
+        integer codes of the passed true concentration time series, identical (after rounding) series share a code.
+        The series of an on disk RaggedTrueConc without digests are not condensed (each series has its own code)
+        :param true_conc_ts_vals: array of true concentration time series (or None) or RaggedTrueConc
+        :param decimals: number of decimals to round the series to before hashing
+        :param digests: None (computed) or the digests from _get_true_conc_digests
+        :return: np.array of integer codes (-1 for None)
+        """
+        if digests is None:
+            digests = DetectionPowerCalculator._get_true_conc_digests(true_conc_ts_vals, decimals)
+        if digests is None:
+            lengths = true_conc_ts_vals.lengths
+            return np.where(lengths > 0, np.arange(len(lengths)), -1)
+        codes, _ = pd.factorize(np.array(digests, dtype=object))
+        return codes
+
+    @staticmethod
+    def _canonicalize_piston_flow(canon_idx, mrt, error, initial_conc, target_conc, previous_slope, max_conc):
+        """
+        map piston flow scenarios to their canonical form (see mulitprocess_power_calcs canonicalize), without a lag
+        (mrt < 1) the previous slope and max concentration are not used so they are set to 0 and max(0, target)
+        :param canon_idx: boolean array of the rows to canonicalize
+        :param mrt: mean residence time values
+        :param error: error values
+        :param initial_conc: initial concentration values
+        :param target_conc: target concentration values
+        :param previous_slope: previous slope values
+        :param max_conc: maximum concentration values
+        :return: error, initial_conc, target_conc, previous_slope, max_conc (copies)
+        """
+        error, initial_conc, target_conc, previous_slope, max_conc = [
+            e.copy() for e in (error, initial_conc, target_conc, previous_slope, max_conc)]
+        scale = error[canon_idx].astype(float)
+        offset = initial_conc[canon_idx].astype(float)
+        max_idx = canon_idx & pd.notna(max_conc)
+        max_conc[max_idx] = (max_conc[max_idx].astype(float) - initial_conc[max_idx].astype(float)) / error[
+            max_idx].astype(float)
+        target_conc[canon_idx] = (target_conc[canon_idx].astype(float) - offset) / scale
+        previous_slope[canon_idx] = previous_slope[canon_idx].astype(float) / scale
+        initial_conc[canon_idx] = 0.
+        error[canon_idx] = 1.
+        no_lag = canon_idx & pd.notna(max_conc) & pd.notna(mrt)
+        no_lag[no_lag] = mrt[no_lag].astype(float) < 1
+        previous_slope[no_lag] = 0.
+        max_conc[no_lag] = np.maximum(target_conc[no_lag].astype(float), 0.)
+        return error, initial_conc, target_conc, previous_slope, max_conc
+
+    def _fan_out_results(self, result_data, run_keys, all_use_idv, id_vals, canon_idx=None, input_vals=None,
+                         partial=False):
+        """
+        order the results by run and fan out to the input rows by the integer run codes
+        :param result_data: pd.DataFrame of results with run_key and idv columns
+        :param run_keys: key of each run
+        :param all_use_idv: run of each input row
+        :param id_vals: idv of each input row
+        :param canon_idx: None or boolean array of the canonicalized rows (see _decanonicalize_results)
+        :param input_vals: None or dict of the input values of the canonicalized columns
+        :param partial: bool, if True only the input rows of the runs in result_data are returned, otherwise every
+                        run must have a result
+        :return: pd.DataFrame indexed by idv
+        """
+        result_data = self._typed_results(result_data.drop_duplicates('run_key'))
+        row_pos = pd.Index(result_data['run_key']).get_indexer(run_keys)[all_use_idv]
+        if partial:
+            rows = np.flatnonzero(row_pos >= 0)
+        else:
+            assert (row_pos >= 0).all(), 'missing results for some runs'
+            rows = np.arange(len(row_pos))
+        outdata = result_data.drop(columns=['run_key', 'idv']).take(row_pos[rows])
+        outdata.index = pd.Index(np.asarray(id_vals)[rows], name='idv')
+        if 'mrt_model' in outdata.columns:
+            # the returned mrt_model is str (object) as for power_calc, the categorical is only used for the blocks
+            outdata['mrt_model'] = outdata['mrt_model'].astype(object)
+        if canon_idx is not None and canon_idx[rows].any():
+            outdata = self._decanonicalize_results(outdata, canon_idx[rows],
+                                                   **{k: v[rows] for k, v in input_vals.items()})
+        return outdata
+
+    def _iter_results(self, checkpoint_dir, cached_blocks, **fan_out_kwargs):
+        """
+        generator of the results of mulitprocess_power_calcs (see stream_results) one block of results at a time,
+        the checkpoint directory is removed once all the blocks are yielded
+        :param checkpoint_dir: path to the checkpoint directory
+        :param cached_blocks: list of result cache blocks
+        :param fan_out_kwargs: passed to _fan_out_results
+        """
+        seen = set()
+        for block in itertools.chain(cached_blocks, _iter_checkpoint(checkpoint_dir)):
+            block = block[~block['run_key'].isin(seen)]
+            seen.update(block['run_key'])
+            if len(block) > 0:
+                yield self._fan_out_results(block, partial=True, **fan_out_kwargs)
+        if checkpoint_dir.exists():
+            shutil.rmtree(checkpoint_dir)
+
+    @staticmethod
+    def _decanonicalize_results(outdata, canon_idx, error, initial_conc, target_conc, previous_slope, max_conc):
+        """
+        restore the input values of canonicalized rows and transform the max concentration back to concentration
+        units (see mulitprocess_power_calcs canonicalize)
+        :param outdata: results (one row per input row)
+        :param canon_idx: boolean array of the canonicalized rows
+        :param error: input error values
+        :param initial_conc: input initial concentration values
+        :param target_conc: input target concentration values
+        :param previous_slope: input previous slope values
+        :param max_conc: input maximum concentration values
+        :return: outdata
+        """
+        outdata = outdata.copy()
+        # failed runs return their kwargs (e.g. prev_slope, max_conc) rather than the power_calc output keys
+        failed = np.zeros(len(outdata), dtype=bool)
+        if 'python_error' in outdata:
+            failed = pd.notna(outdata['python_error'].values)
+        success_idx = canon_idx & ~failed
+        failed_idx = canon_idx & failed
+        outdata.loc[success_idx, 'max_conc'] = (outdata.loc[success_idx, 'max_conc'].astype(float).values
+                                                * error[success_idx].astype(float)
+                                                + initial_conc[success_idx].astype(float))
+        restore = [
+            (canon_idx, 'error', error),
+            (canon_idx, 'initial_conc', initial_conc),
+            (canon_idx, 'target_conc', target_conc),
+            (success_idx, 'previous_slope', previous_slope),
+            (success_idx, 'max_conc_lim', max_conc),
+            (failed_idx, 'prev_slope', previous_slope),
+            (failed_idx, 'max_conc', max_conc),
+        ]
+        for idx, col, vals in restore:
+            if idx.any():
+                outdata.loc[idx, col] = vals[idx]
+        return outdata
+
     @staticmethod
     def _adjust_shape(x, shape, none_allowed, is_int, idv):
         """
-        helper function to adjust the shape of an input variable
+        helper function to adjust the shape of an input variable, the validation and broadcasting are vectorised
         :param x: input variable
         :param shape: shape needed
         :param none_allowed: Is None allowed as a value
         :param is_int: is it an integer
         :param idv: str name of the input variable for error messages
-        :return:
+        :return: np.array with shape, integers are int64 with missing (None) values as _int_missing, numbers are float
+                 with missing values as nan (see _run_value and _is_present)
         """
-        if x is None and none_allowed:
-            x = np.full(shape, None)
-            return x
-
+        kind = 'an integer' if is_int else 'a number'
+        if x is None:
+            assert none_allowed, f'{idv} must not be None'
+            return np.full(shape, _int_missing, dtype=np.int64) if is_int else np.full(shape, np.nan)
+
+        if np.ndim(x) == 0:
+            is_kind = pd.api.types.is_integer(x) and x != _int_missing if is_int else pd.api.types.is_number(x)
+            assert is_kind, f'{idv} must be {kind} or have shape {shape} got: {x}'
+            return np.full(shape, x, dtype=np.int64 if is_int else float)
+
+        x = np.asarray(x)
+        assert x.shape == shape, (f'wrong_shape for {idv} must be {kind} or have shape {shape} '
+                                  f'got: shp {x.shape} dtype {x.dtype}')
+        values, bad = None, None
         if is_int:
-            if pd.api.types.is_integer(x):
-                x = np.full(shape, x, dtype=int)
+            # integers are checked by dtype (not by value) and kept as int64 so large seeds are not rounded, only
+            # None is missing (nan is not an integer)
+            if pd.api.types.is_integer_dtype(x):
+                missing = np.zeros(shape, dtype=bool)
+                values = x.astype(np.int64)
+                bad = values == _int_missing
+            elif x.dtype == object:
+                missing = np.equal(x, None)
+                if pd.api.types.infer_dtype(x[~missing], skipna=False) in ['integer', 'empty']:
+                    values = np.full(shape, _int_missing, dtype=np.int64)
+                    values[~missing] = x[~missing].astype(np.int64)
+                    bad = ~missing & (values == _int_missing)
             else:
-                x = np.atleast_1d(x)
-                assert x.shape == shape, (f'wrong_shape for {idv} must have shape {shape} '
-                                          f'got: shp {x.shape} dtype {x.dtype}')
-                not_bad = [e is None or pd.api.types.is_integer(e) for e in x]
-                assert all(not_bad), (f'{idv} must be an integer or None got {x[~np.array(not_bad)]} '
-                                      f'at indices {np.where(~np.array(not_bad))[0]}')
+                missing = np.zeros(shape, dtype=bool)
+        elif x.dtype == object:
+            missing = pd.isna(x)
+            ok_types = ['integer', 'empty', 'floating', 'mixed-integer-float', 'decimal']
+            if pd.api.types.infer_dtype(x[~missing], skipna=False) in ok_types:
+                values = np.full(shape, np.nan)
+                values[~missing] = x[~missing].astype(float)
+                bad = np.zeros(shape, dtype=bool)
+        elif pd.api.types.is_integer_dtype(x) or pd.api.types.is_float_dtype(x):
+            values = x.astype(float)
+            missing = np.isnan(values)
+            bad = np.zeros(shape, dtype=bool)
         else:
-            if pd.api.types.is_number(x):
-                x = np.full(shape, x).astype(float)
-            else:
-                x = np.atleast_1d(x)
-                assert x.shape == shape, (f'wrong_shape for {idv} must be a float or have shape {shape} '
-                                          f'got: shp {x.shape} dtype {x.dtype}')
-                not_bad = [e is None or pd.api.types.is_number(e) for e in x]
-                assert all(not_bad), (f'{idv} must be an number or None got {x[~np.array(not_bad)]} '
-                                      f'at indices {np.where(~np.array(not_bad))[0]}')
-        return x
+            missing = np.zeros(shape, dtype=bool)
+
+        if values is None:
+            is_kind = pd.api.types.is_integer if is_int else pd.api.types.is_number
+            bad = np.array([not (m or is_kind(e)) for m, e in zip(missing, x)])
+        if not none_allowed:
+            bad |= missing
+        assert not bad.any(), (f'{idv} must be {kind}{" or None" if none_allowed else ""} got {x[bad]} '
+                               f'at indices {np.where(bad)[0]}')
+        return values
+
+    @staticmethod
+    def _trusted_rows(mrt_model, has_true_conc, **kwargs):
+        """
+        vectorised version of _check_power_calc_inputs for the nan masked inputs of mulitprocess_power_calcs (the
+        types are checked by _adjust_shape)
+        :param mrt_model: array of mrt models
+        :param has_true_conc: boolean array, True where a true concentration series is passed
+        :param kwargs: power_calc kwarg name: array from _adjust_shape (samp_years, samp_per_year,
+                       implementation_time, initial_conc, target_conc, prev_slope, max_conc, min_conc, mrt_p1,
+                       frac_p1, f_p1, f_p2)
+        :return: boolean array, True where the inputs pass the checks
+        """
+        present = {k: _is_present(v) for k, v in kwargs.items()}
+        lag_models = (mrt_model == 'piston_flow') | (mrt_model == 'binary_exponential_piston_flow')
+        lag_ok = ~has_true_conc
+        for k in ['samp_years', 'samp_per_year', 'implementation_time', 'initial_conc', 'target_conc', 'prev_slope',
+                  'max_conc']:
+            lag_ok &= present[k]
+        with np.errstate(invalid='ignore'):
+            lag_ok &= kwargs['max_conc'] >= kwargs['initial_conc']
+            lag_ok &= kwargs['max_conc'] >= kwargs['target_conc']
+        bepfm_ok = np.full(mrt_model.shape, age_tools_imported)
+        for k in ['mrt_p1', 'frac_p1', 'f_p1', 'f_p2', 'min_conc']:
+            bepfm_ok &= present[k]
+        pass_ok = has_true_conc.copy()
+        for k in present:
+            pass_ok &= ~present[k]
+        return np.where(lag_models, lag_ok & np.where(mrt_model == 'piston_flow', True, bepfm_ok),
+                        (mrt_model == 'pass_true_conc') & pass_ok)
 
     @staticmethod
     def _check_propogate_truets(x, shape):
@@ -1006,6 +1712,8 @@ class DetectionPowerCalculator:
         else:
             len_x = len(x)
             assert len_x == shape[0], f'wrong_shape for true_conc_ts_vals must have len {shape[0]} got: shp {len_x}'
+            if not isinstance(x, RaggedTrueConc):
+                x = RaggedTrueConc.from_list(x)
             return x
 
     def mulitprocess_power_calcs(
@@ -1027,9 +1735,13 @@ class DetectionPowerCalculator:
             frac_p1_vals: {np.ndarray, float, None} = None,
             f_p1_vals: {np.ndarray, float, None} = None,
             f_p2_vals: {np.ndarray, float, None} = None,
-            true_conc_ts_vals: {np.ndarray, list, None} = None,
+            true_conc_ts_vals: {np.ndarray, list, None, 'RaggedTrueConc'} = None,
             seed: {np.ndarray, int, None} = 5585,
             run=True,
+            canonicalize=False,
+            checkpoint_batch=None,
+            chunksize=None,
+            stream_results=False,
     ):
         """
         multiprocessing wrapper for power_calc, see power_calc for details
@@ -1064,10 +1776,44 @@ class DetectionPowerCalculator:
                             bianary exponential piston flow) otherwise set to None
         :param true_conc_ts_vals: the true concentration time series for each simulation only used for the
                                     'pass_true_conc' mrt_model, note that this can be a list of arrays of different
-                                    lengths for each simulation, Numpy does not support jagged arrays
-        :param seed: ndarray (integer seeds), None (no seeds), or int (1 seed for all simulations)
+                                    lengths for each simulation, Numpy does not support jagged arrays.
+                                    Identical series (rounded to 6 decimals) with the same other inputs (including
+                                    the seed) are only run once.  The series are held as one flat array (see
+                                    RaggedTrueConc, which can also be passed directly) that is placed in shared memory
+                                    for the workers, so the series are not copied into each task.  A RaggedTrueConc
+                                    loaded from disk (RaggedTrueConc.load) is memory mapped and read directly by the
+                                    workers
+        :param seed: ndarray (integer seeds), None (no seeds), or int (1 seed for all simulations). The seed is part
+                     of the condensed run, so rows that differ only by seed are run separately (each with its own
+                     seed) rather than condensed into the run of the first such row
         :param run: if True run the simulations, if False just build  the run_dict and print the number of simulations
+        :param canonicalize: bool, if True then piston_flow scenarios (with error > 0) are mapped to a canonical form
+                             before condensing the runs: concentrations c -> (c - initial_conc) / error (and
+                             previous_slope -> previous_slope / error, error -> 1).  All of the significance tests
+                             are invariant to this transform (the noise is scaled by the same factor) so equivalent
+                             scenarios share one simulation.  The canonical values are condensed at a precision of
+                             1e-6 (the rows that are not canonicalized keep the usual precision), the returned input values are those passed for each row and the max_conc is
+                             transformed back to concentration units.
+        :param checkpoint_batch: None or int, if not None then results are collected as they complete and every
+                                 checkpoint_batch results are written to a checkpoint directory next to outpath
+                                 ({outpath.stem}_checkpoint, requires outpath). If the job is interrupted, re-running
+                                 the same call skips the runs already in the checkpoint (matched by a hash of the
+                                 run inputs and the calculator options, see result_cache_path), a checkpoint
+                                 holding runs that are not part of this call (e.g. from a different job saved to
+                                 the same outpath) is removed with a warning and the job starts afresh. The checkpoint
+                                 directory is removed once outpath has been written.
+        :param chunksize: None or int, the number of runs passed to a worker as one task (and returned as one
+                          block), if None the runs are chunked by their predicted cost (see _RunCostModel): about 4
+                          tasks per core for load balancing, capped at 1000 runs (and at checkpoint_batch).  In
+                          either case the runs with the largest predicted cost are dispatched first
+        :param stream_results: bool, if True (requires checkpoint_batch) the results are not assembled in memory
+                               (which needs memory for the results of the whole job), instead a generator is returned
+                               that yields the results one checkpoint batch at a time (a dataframe of the input rows
+                               of the runs in the batch, in input order, and one for the result cache hits).  outpath
+                               is not written and the checkpoint directory is removed once the generator is exhausted
         :return: dataframe with input data and the results of all of the power calcs. note power is percent 0-100
+                 if adaptive_nsims the achieved number of simulations and the power interval are also returned
+                 ('nsims_run', 'power_lower', 'power_upper'), or a generator of dataframes if stream_results
         """
         if self.return_true_conc or self.return_noisy_conc_itters > 0:
             warnings.warn('return_true_conc and return_noisy_conc_itters are not supported for mulitprocess_power_calcs'
@@ -1075,6 +1821,10 @@ class DetectionPowerCalculator:
 
         if isinstance(outpath, str):
             outpath = Path(outpath)
+        assert checkpoint_batch is None or (outpath is not None and pd.api.types.is_integer(checkpoint_batch)
+                                            and checkpoint_batch > 0), (
+            'checkpoint_batch must be None or a positive integer, and outpath must be passed to checkpoint')
+        assert not stream_results or checkpoint_batch is not None, 'stream_results requires checkpoint_batch'
         id_vals = np.atleast_1d(id_vals)
         expect_shape = id_vals.shape
 
@@ -1126,89 +1876,90 @@ class DetectionPowerCalculator:
         assert (max_conc_vals[not_na_idx] >= target_conc_vals[
             not_na_idx]).all(), 'max_conc must be greater than or equal to target_conc'
 
-        run_vals = [
-            id_vals,
-            error_vals,
-            samp_years_vals,
-            samp_per_year_vals,
-            implementation_time_vals,
-            initial_conc_vals,
-            target_conc_vals,
-            previous_slope_vals,
-            max_conc_vals,
-            min_conc_vals,
-            mrt_model_vals,
-            mrt_vals,
-            mrt_p1_vals,
-            frac_p1_vals,
-            f_p1_vals,
-            f_p2_vals,
-            true_conc_ts_vals,
-            use_seeds
-
-        ]
-        runs = []
-        run_list = []
-        all_use_idv = []
-        # make runs
+        # rows that pass the power_calc input checks (vectorised) are run without re-checking the inputs, the other
+        # rows are checked by each run (so the check error is returned in python_error)
+        has_true_conc = np.zeros(expect_shape, dtype=bool)
+        if isinstance(true_conc_ts_vals, RaggedTrueConc):
+            has_true_conc = true_conc_ts_vals.lengths > 0
+        trusted = self._trusted_rows(mrt_model_vals, has_true_conc, samp_years=samp_years_vals,
+                                     samp_per_year=samp_per_year_vals, implementation_time=implementation_time_vals,
+                                     initial_conc=initial_conc_vals, target_conc=target_conc_vals,
+                                     prev_slope=previous_slope_vals, max_conc=max_conc_vals, min_conc=min_conc_vals,
+                                     mrt_p1=mrt_p1_vals, frac_p1=frac_p1_vals, f_p1=f_p1_vals, f_p2=f_p2_vals)
+
+        canon_idx = np.zeros(expect_shape, dtype=bool)
+        if canonicalize:
+            canon_idx = ((mrt_model_vals == 'piston_flow') & pd.notna(error_vals) & pd.notna(initial_conc_vals)
+                         & pd.notna(target_conc_vals) & pd.notna(previous_slope_vals))
+            canon_idx[canon_idx] = error_vals[canon_idx].astype(float) > 0
+            input_vals = {'error': error_vals, 'initial_conc': initial_conc_vals, 'target_conc': target_conc_vals,
+                          'previous_slope': previous_slope_vals, 'max_conc': max_conc_vals}
+            (error_vals, initial_conc_vals, target_conc_vals,
+             previous_slope_vals, max_conc_vals) = self._canonicalize_piston_flow(canon_idx, mrt_vals, **input_vals)
+
+        # create unique runs so that if multiple sites are passed with the same values (within rounding error)
+        # they are only run once, each column is reduced to integer codes of its (rounded) id string and the unique
+        # rows of the code matrix are the runs
         print('creating and condensing runs')
-        for i, (
-                idv, error, samp_years, samp_per_year, implementation_time,
-                inital_conc, target_conc, previous_slope, max_conc, min_conc,
-                mrt_model, mrt, mrt_p1, frac_p1, f_p1, f_p2, true_conc_ts, seed_val
-        ) in enumerate(zip(*run_vals)):
-            # create unique value so that if multiple sites are passed with the same values (within rounding error)
-            # they are only run once
-            if true_conc_ts is None:
-                ptis = None
-            else:
-                ptis = i
-            if i % 1000 == 0:
-                print(f'forming/condesing run {i} of {len(id_vals)}')
-
-            use_idv = (
-                self._get_id_str(error, 'error'),
-                self._get_id_str(samp_years, 'samp_years'),
-                self._get_id_str(samp_per_year, 'samp_per_year'),
-                self._get_id_str(implementation_time, 'implementation_time'),
-                self._get_id_str(inital_conc, 'inital_conc'),
-                self._get_id_str(target_conc, 'target_conc'),
-                self._get_id_str(previous_slope, 'previous_slope', 2),
-                self._get_id_str(max_conc, 'max_conc'),
-                self._get_id_str(min_conc, 'min_conc'),
-                self._get_id_str(mrt_model, 'mrt_model'),
-                self._get_id_str(mrt, 'mrt', 0),
-                self._get_id_str(mrt_p1, 'mrt_p1'),
-                self._get_id_str(frac_p1, 'frac_p1', 2),
-                self._get_id_str(f_p1, 'f_p1', 2),
-                self._get_id_str(f_p2, 'f_p2', 2),
-                self._get_id_str(ptis, 'ptis'),
-            )
-            use_idv = '_'.join(use_idv)
-            all_use_idv.append(use_idv)
-            if use_idv in run_list:
-                continue
-            run_list.append(use_idv)
+        true_conc_digests = self._get_true_conc_digests(true_conc_ts_vals)
+        use_result_cache = self.result_cache is not None
+        if true_conc_digests is None:
+            use_result_cache = False
+            warnings.warn('the true concentration store has no digests (see RaggedTrueConc.compute_digests), identical '
+                          'series are not condensed and the result cache is not used')
+        id_codes = [
+            self._get_conc_id_codes(error_vals, 'error', canon_idx),
+            self._get_id_codes(samp_years_vals, 'samp_years'),
+            self._get_id_codes(samp_per_year_vals, 'samp_per_year'),
+            self._get_id_codes(implementation_time_vals, 'implementation_time'),
+            self._get_conc_id_codes(initial_conc_vals, 'inital_conc', canon_idx),
+            self._get_conc_id_codes(target_conc_vals, 'target_conc', canon_idx),
+            self._get_conc_id_codes(previous_slope_vals, 'previous_slope', canon_idx, float_percision=2),
+            self._get_conc_id_codes(max_conc_vals, 'max_conc', canon_idx),
+            self._get_id_codes(min_conc_vals, 'min_conc'),
+            self._get_id_codes(mrt_model_vals, 'mrt_model'),
+            self._get_id_codes(mrt_vals, 'mrt', 0),
+            self._get_id_codes(mrt_p1_vals, 'mrt_p1'),
+            self._get_id_codes(frac_p1_vals, 'frac_p1', 2),
+            self._get_id_codes(f_p1_vals, 'f_p1', 2),
+            self._get_id_codes(f_p2_vals, 'f_p2', 2),
+            # passed true concentrations are condensed by their (rounded) content
+            self._get_true_conc_codes(true_conc_ts_vals, digests=true_conc_digests),
+            # rows are only condensed when they share a seed, otherwise the result of a row would depend on the seed of
+            # whichever row was run first
+            self._get_id_codes(use_seeds, 'seed'),
+        ]
+        # combine the columns pairwise, factorizing keeps the combined key small and numbers the runs in order of
+        # first occurrence
+        all_use_idv = np.zeros(len(id_vals), dtype=np.int64)
+        for codes in id_codes:
+            codes, _ = pd.factorize(codes)
+            all_use_idv, _ = pd.factorize(all_use_idv * (codes.max() + 1) + codes)
+        _, first_idx = np.unique(all_use_idv, return_index=True)
 
+        runs = []
+        for run_idv, i in enumerate(first_idx):
             runs.append(dict(
-                idv=use_idv,
-                error=error,
-                samp_years=samp_years,
-                samp_per_year=samp_per_year,
-                implementation_time=implementation_time,
-                initial_conc=inital_conc,
-                target_conc=target_conc,
-                prev_slope=previous_slope,
-                max_conc=max_conc,
-                min_conc=min_conc,
-                mrt_model=mrt_model,
-                mrt=mrt,
-                mrt_p1=mrt_p1,
-                frac_p1=frac_p1,
-                f_p1=f_p1,
-                f_p2=f_p2,
-                true_conc_ts=true_conc_ts,
-                seed=seed_val,
+                idv=run_idv,
+                error=_run_value(error_vals[i]),
+                samp_years=_run_value(samp_years_vals[i], is_int=True),
+                samp_per_year=_run_value(samp_per_year_vals[i], is_int=True),
+                implementation_time=_run_value(implementation_time_vals[i], is_int=True),
+                initial_conc=_run_value(initial_conc_vals[i]),
+                target_conc=_run_value(target_conc_vals[i]),
+                prev_slope=_run_value(previous_slope_vals[i]),
+                max_conc=_run_value(max_conc_vals[i]),
+                min_conc=_run_value(min_conc_vals[i]),
+                mrt_model=mrt_model_vals[i],
+                mrt=_run_value(mrt_vals[i]),
+                mrt_p1=_run_value(mrt_p1_vals[i]),
+                frac_p1=_run_value(frac_p1_vals[i]),
+                f_p1=_run_value(f_p1_vals[i]),
+                f_p2=_run_value(f_p2_vals[i]),
+                true_conc_ts=true_conc_ts_vals[i],
+                true_conc_idx=i,
+                seed=_run_value(use_seeds[i], is_int=True),
+                trusted=bool(trusted[i]),
 
             ))
 
@@ -1217,22 +1968,1248 @@ class DetectionPowerCalculator:
         if not run:
             print(f'stopping as {run=}')
             return
-        result_data = _run_multiprocess(self._power_calc_mp, runs, num_cores=self.ncores,
-                                        logging_level=self.log_level)
-        result_data = pd.DataFrame(result_data)
-        result_data.set_index('idv', inplace=True)
-
-        outdata = result_data.loc[all_use_idv]
-        outdata.loc[:, 'idv'] = id_vals
-        outdata.set_index('idv', inplace=True)
+        # results are held as blocks (dataframes) with a run_key column, the key is a hash of the run inputs if they
+        # are shared across calls (result cache or checkpoint) otherwise the run idv
+        if use_result_cache or checkpoint_batch is not None:
+            if true_conc_digests is None:
+                # the series of a store without digests are keyed by their position in the store
+                store_path = true_conc_ts_vals.path.resolve()
+                run_digests = [None if r['true_conc_ts'] is None else f'{store_path}:{r["true_conc_idx"]}'
+                               for r in runs]
+            else:
+                run_digests = [true_conc_digests[r['true_conc_idx']] for r in runs]
+            run_keys = [self._result_cache_key(r, d) for r, d in zip(runs, run_digests)]
+        else:
+            run_keys = [r['idv'] for r in runs]
+        done = set()
+        cached_blocks, new_blocks = [], []
+        checkpoint_dir = None
+        if checkpoint_batch is not None:
+            checkpoint_dir = outpath.parent.joinpath(f'{outpath.stem}_checkpoint')
+            for batch in _iter_checkpoint(checkpoint_dir):
+                done.update(batch['run_key'])
+            stale = done.difference(run_keys)
+            if len(stale) > 0:
+                # the checkpoint belongs to a different job (or calculator options) saved at the same outpath
+                warnings.warn(f'{len(stale)} runs in the checkpoint {checkpoint_dir} are not part of this job, '
+                              f'the checkpoint is removed and all runs are re-run')
+                shutil.rmtree(checkpoint_dir)
+                done = set()
+            if len(done) > 0:
+                _logger.info(f'{len(done)} runs loaded from checkpoint {checkpoint_dir}')
+            if self.screen_power:
+                self.screen_counts['checkpoint'] += len(done)
+        if use_result_cache:
+            cached = self.result_cache.get_many([k for k in run_keys if k not in done])
+            if len(cached) > 0:
+                cached_blocks.append(pd.DataFrame(list(cached.values())).assign(run_key=list(cached.keys())))
+            done.update(cached.keys())
+            if self.screen_power:
+                self.screen_counts['cached'] += len(cached)
+        new_runs = [r for r, key in zip(runs, run_keys) if key not in done]
+        if len(new_runs) < len(runs):
+            print(f'{len(runs) - len(new_runs)} runs already complete, running {len(new_runs)} runs')
+
+        def save_batch(blocks):
+            if len(blocks) == 0:
+                return
+            batch = pd.concat(blocks, ignore_index=True)
+            batch['run_key'] = [run_keys[i] for i in batch['idv']]
+            if self.screen_power:
+                # the screen counts of the subprocesses are not shared, so count from the results (unique runs)
+                for screen, count in batch['screen'].value_counts().items():
+                    self.screen_counts[screen] += count
+            if use_result_cache:
+                success = batch['python_error'].isna()  # errors are not cached
+                self.result_cache.put_many({r.pop('run_key'): r for r in batch[success].to_dict('records')})
+            if checkpoint_dir is not None:
+                _write_checkpoint_batch(checkpoint_dir, batch)
+            else:
+                new_blocks.append(batch)
+
+        if len(new_runs) > 0:
+            # dispatch the most expensive runs first (by the predicted cost) so the pool does not finish on a few
+            # long runs, the chunks hold about equal predicted cost
+            cost_model = _RunCostModel(self.significance_mode, getattr(self, 'efficent_mode', False), self.nsims)
+            costs = cost_model.predict(_run_nsamples(new_runs))
+            assert chunksize is None or (pd.api.types.is_integer(chunksize) and chunksize > 0), (
+                'chunksize must be None or a positive integer')
+            pool_size = self.ncores if self.ncores is not None else psutil.cpu_count(logical=True)
+            chunks = _cost_chunks(costs, pool_size, chunksize=chunksize, max_chunksize=checkpoint_batch)
+            run_nsamples = dict(zip([r['idv'] for r in new_runs], _run_nsamples(new_runs)))
+            run_costs = dict(zip([r['idv'] for r in new_runs], costs))
+            # the true concentration series are read by the workers from shared memory or the on disk store of the
+            # series (see _start_process)
+            shared_true_conc, shm = None, None
+            if isinstance(true_conc_ts_vals, RaggedTrueConc):
+                shm, shared_true_conc = true_conc_ts_vals._to_worker_spec()
+                chunks = [[dict(new_runs[i], true_conc_ts=None) for i in chunk] for chunk in chunks]
+            else:
+                chunks = [[new_runs[i] for i in chunk] for chunk in chunks]
+            print(f'predicted run time: {costs.sum() / pool_size:.0f} s (on {pool_size} processes)')
+            pending, ndone = [], 0
+
+            def on_result(outputs):
+                nonlocal pending, ndone
+                for block, elapsed in outputs:
+                    cost_model.update([run_nsamples[i] for i in block['idv']], [run_costs[i] for i in block['idv']],
+                                      elapsed)
+                    for i in block['idv']:
+                        run_nsamples.pop(i)
+                    pending.append(block)
+                    ndone += len(block)
+                if checkpoint_batch is not None and sum(len(b) for b in pending) >= checkpoint_batch:
+                    save_batch(pending)
+                    pending = []
+                    remaining = cost_model.predict(list(run_nsamples.values())).sum()
+                    print(f'{ndone} of {len(new_runs)} runs complete, about {remaining / pool_size:.0f} s remaining')
+
+            # each worker builds its own calculator once (see _start_process) so the tasks only carry the runs
+            try:
+                _run_multiprocess(_worker_power_calc_batch, chunks, num_cores=self.ncores,
+                                  logging_level=self.log_level,
+                                  calculator=self._worker_copy(),
+                                  shared_true_conc=shared_true_conc, callback=on_result, batch_size=1, chunksize=1)
+            finally:
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+            save_batch(pending)
+        if self.screen_power:
+            print(f'screened runs: {self.screen_counts}')
+        if use_result_cache:
+            self.result_cache.evict()
+            print(f'result cache: {self.result_cache.stats}')
+
+        fan_out_kwargs = dict(run_keys=run_keys, all_use_idv=all_use_idv, id_vals=id_vals)
+        if canonicalize:
+            fan_out_kwargs.update(canon_idx=canon_idx, input_vals=input_vals)
+        if stream_results:
+            return self._iter_results(checkpoint_dir, cached_blocks, **fan_out_kwargs)
+
+        if checkpoint_dir is not None:
+            new_blocks = [_read_checkpoint(checkpoint_dir)]
+        result_data = pd.concat([b for b in cached_blocks + new_blocks if b is not None], ignore_index=True)
+        cached_blocks.clear()
+        new_blocks.clear()
+        outdata = self._fan_out_results(result_data, **fan_out_kwargs)
 
         if outpath is not None:
             outpath.parent.mkdir(parents=True, exist_ok=True)
             outdata.to_hdf(outpath, 'data')
+        if checkpoint_dir is not None and checkpoint_dir.exists():
+            shutil.rmtree(checkpoint_dir)
         return outdata
 
 
-def _run_multiprocess(func, runs, logical=True, num_cores=None, logging_level=logging.INFO):
+def _batch_linregress(x, y):
+    """
+    vectorised ordinary least squares regression of each row of y against x, reproduces the slope, standard error
+    and two-sided p-value of scipy.stats.linregress without a python loop over the rows.  A constant row has no
+    trend: slope 0, standard error 0 and p-value 1 (scipy returns nan for the standard error and p-value)
+    :param x: np.array of shape (n_samples,)
+    :param y: np.array of shape (nsims, n_samples)
+    :return: slope, slope_stderr, p_value (each np.array of shape (nsims,))
+    """
+    y = np.atleast_2d(y)
+    n_samples = x.shape[0]
+    assert y.shape[1] == n_samples, f'y must have shape (nsims, {n_samples}) got {y.shape}'
+    df = n_samples - 2
+    tiny = 1.0e-20  # same as scipy.stats.linregress
+
+    xm = x - x.mean()
+    ym = y - y.mean(axis=1, keepdims=True)
+    ssxm = np.dot(xm, xm) / n_samples
+    ssym = np.einsum('ij,ij->i', ym, ym) / n_samples
+    ssxym = ym @ xm / n_samples
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = ssxym / np.sqrt(ssxm * ssym)
+        r = np.where(ssym == 0, 0., r)
+        r = np.clip(r, -1., 1.)
+        slope = ssxym / ssxm
+        t = r * np.sqrt(df / ((1.0 - r + tiny) * (1.0 + r + tiny)))
+        slope_stderr = np.sqrt((1 - r ** 2) * ssym / ssxm / df)
+    p_value = 2 * stats.t.sf(np.abs(t), df)
+    return slope, slope_stderr, p_value
+
+
+def _analytic_linregress_power(true_y, error, alpha, expected_slope=None):
+    """
+    probability that the ols slope of true_y + N(0, error) noise is significant (p < alpha) and in the direction of
+    expected_slope.  The slope estimate is normal so t = b / se(b) follows a non-central t distribution with
+    non-centrality slope * sqrt(Sxx) / error.  If true_y is not linear the residuals also contain the lack of fit,
+    which is approximated by scaling the t statistic by sqrt(1 + RSS_true / (df * error^2)).
+    :param true_y: noise free data (1d)
+    :param error: standard deviation of the noise
+    :param alpha: significance level
+    :param expected_slope: None (either direction) or the expected slope (only the sign is used)
+    :return: power (0-1)
+    """
+    true_y = np.asarray(true_y, dtype=float)
+    n_samples = len(true_y)
+    x = np.arange(n_samples)
+    if error == 0:  # deterministic, the test on the noise free data
+        slope, _, p_value = _batch_linregress(x, true_y[np.newaxis])
+        detected = p_value[0] < alpha
+        if expected_slope is not None:
+            detected = detected and np.sign(slope[0]) == np.sign(expected_slope)
+        return float(detected)
+
+    df = n_samples - 2
+    ssxm = np.sum((x - x.mean()) ** 2)
+    slope = np.sum((x - x.mean()) * (true_y - true_y.mean())) / ssxm
+    rss_true = np.sum((true_y - true_y.mean() - slope * (x - x.mean())) ** 2)
+    nc = slope * np.sqrt(ssxm) / error
+    t_crit = stats.t.ppf(1 - alpha / 2, df) * np.sqrt(1 + rss_true / (df * error ** 2))
+    power_pos = stats.nct.sf(t_crit, df, nc)
+    power_neg = stats.nct.cdf(-t_crit, df, nc)
+    return _directional_power(power_pos, power_neg, expected_slope)
+
+
+def _analytic_linregress_power_bounds(true_y, error, alpha, expected_slope=None, delta=1e-6):
+    """
+    conservative bounds of the power of the ols slope test (see _analytic_linregress_power) used by screen_power.  The
+    slope estimate b is normal and independent of the residuals, whose sum of squares is error^2 times a non-central
+    chi-squared (df, RSS_true / error^2) where RSS_true is the lack of fit of the noise free data, so:
+        * upper bound: the power without the lack of fit, a larger residual variance only shrinks |t|
+        * lower bound: with probability >= 1 - delta the residual variance is below its 1 - delta quantile q, so the
+          power is >= (1 - delta) * P(|b| / sd(b) > t_crit * sqrt(q / df))
+    :param true_y: noise free data (1d)
+    :param error: standard deviation of the noise
+    :param alpha: significance level
+    :param expected_slope: None (either direction) or the expected slope (only the sign is used)
+    :param delta: probability that the residual variance exceeds the value used for the lower bound
+    :return: lower, upper (0-1)
+    """
+    true_y = np.asarray(true_y, dtype=float)
+    if error == 0:  # deterministic
+        power = _analytic_linregress_power(true_y, error, alpha, expected_slope)
+        return power, power
+    n_samples = len(true_y)
+    x = np.arange(n_samples)
+    df = n_samples - 2
+    ssxm = np.sum((x - x.mean()) ** 2)
+    slope = np.sum((x - x.mean()) * (true_y - true_y.mean())) / ssxm
+    rss_true = np.sum((true_y - true_y.mean() - slope * (x - x.mean())) ** 2)
+    nc = slope * np.sqrt(ssxm) / error
+    t_crit = stats.t.ppf(1 - alpha / 2, df)
+    upper = _directional_power(stats.nct.sf(t_crit, df, nc), stats.nct.cdf(-t_crit, df, nc), expected_slope)
+    if rss_true > 0:
+        q = stats.ncx2.ppf(1 - delta, df, rss_true / error ** 2)
+    else:
+        q = stats.chi2.ppf(1 - delta, df)
+    z_crit = t_crit * np.sqrt(q / df)
+    lower = (1 - delta) * _directional_power(stats.norm.sf(z_crit - nc), stats.norm.cdf(-z_crit - nc),
+                                             expected_slope)
+    return lower, upper
+
+
+def _directional_power(power_pos, power_neg, expected_slope):
+    """
+    :param power_pos: probability of a significant increase
+    :param power_neg: probability of a significant decrease
+    :param expected_slope: None (either direction) or the expected slope (only the sign is used)
+    :return: power in the direction of expected_slope
+    """
+    if expected_slope is None:
+        return power_pos + power_neg
+    if np.sign(expected_slope) > 0:
+        return power_pos
+    if np.sign(expected_slope) < 0:
+        return power_neg
+    return 0.
+
+
+def _analytic_mann_kendall_power(true_y, error, alpha, expected_slope=None):
+    """
+    normal approximation of the probability that the mann kendall test of true_y + N(0, error) noise is significant
+    (p < alpha) and in the direction of expected_slope.  Each pair i < j increases with probability
+    Phi((y_j - y_i) / (error * sqrt(2))) which gives E[S] exactly.  Var(S) is the sum of the pair variances plus the
+    covariance of pairs sharing a sample, the latter approximated by the null covariance scaled by the squared mean
+    pair variance.  The test statistic uses the null variance (no ties in noisy data).
+    :param true_y: noise free data (1d)
+    :param error: standard deviation of the noise
+    :param alpha: significance level
+    :param expected_slope: None (either direction) or the expected slope (only the sign is used)
+    :return: power (0-1)
+    """
+    true_y = np.asarray(true_y, dtype=float)
+    n_samples = len(true_y)
+    if error == 0:  # deterministic, the test on the noise free data
+        trend, h, p, z, s, var_s = _batch_mann_kendall(true_y[np.newaxis], alpha)
+        detected = p[0] < alpha
+        if expected_slope is not None:
+            detected = detected and np.sign(trend[0]) == np.sign(expected_slope)
+        return float(detected)
+
+    mean_s, pair_var = 0., 0.
+    for lag in range(1, n_samples):  # O(n) memory
+        expect_sign = 2 * special.ndtr((true_y[lag:] - true_y[:-lag]) / (error * np.sqrt(2))) - 1
+        mean_s += expect_sign.sum()
+        pair_var += (1 - expect_sign ** 2).sum()
+    npairs = n_samples * (n_samples - 1) / 2
+    null_var = n_samples * (n_samples - 1) * (2 * n_samples + 5) / 18
+    var_s = pair_var + (null_var - npairs) * (pair_var / npairs) ** 2
+
+    # significant if (S - sign(S)) / sqrt(null_var) exceeds the critical z
+    s_crit = stats.norm.ppf(1 - alpha / 2) * np.sqrt(null_var) + 1
+    if var_s <= 0:
+        power_pos, power_neg = float(mean_s > s_crit), float(mean_s < -s_crit)
+    else:
+        power_pos = stats.norm.sf(s_crit, mean_s, np.sqrt(var_s))
+        power_neg = stats.norm.cdf(-s_crit, mean_s, np.sqrt(var_s))
+    return _directional_power(power_pos, power_neg, expected_slope)
+
+
+# series longer than this use the O(n log n) inversion count rather than the pairwise lag loop
+_mk_pairwise_max_n = 150
+# maximum number of elements (nsims * nsamples) processed at once by the batch mann kendall kernel
+_mk_chunk_elements = 2_000_000
+
+
+def _batch_mann_kendall(y, alpha):
+    """
+    vectorised mann kendall test of each row of y, reproduces the trend, h, p, z, s, var_s of
+    kendall_stats.MannKendall (tie corrected variance, continuity corrected z, two sided p) without building a
+    MannKendall object per row.  Rows are processed in memory bounded chunks (see _mk_chunk_elements)
+    :param y: np.array of shape (nsims, n_samples)
+    :param alpha: significance level
+    :return: trend, h, p, z, s, var_s (each np.array of shape (nsims,))
+    """
+    y = np.atleast_2d(y)
+    n_sims, n_samples = y.shape
+    assert np.isfinite(y).all(), 'mann kendall data must not contain nan or inf values'
+    s = np.zeros(n_sims, dtype=np.int64)
+    ties = np.zeros(n_sims, dtype=np.int64)
+    chunk_size = max(1, _mk_chunk_elements // max(n_samples, 1))
+    for i in range(0, n_sims, chunk_size):
+        s[i:i + chunk_size], ties[i:i + chunk_size] = _mann_kendall_s(y[i:i + chunk_size])
+
+    var_s = (n_samples * (n_samples - 1) * (2 * n_samples + 5) - ties) / 18
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(s == 0, 0., (s - np.sign(s)) / np.sqrt(var_s))
+    p = 2 * stats.norm.sf(np.abs(z))
+    h = np.abs(z) > stats.norm.ppf(1 - alpha / 2)
+    trend = (np.sign(z) * h).astype(int)
+    return trend, h, p, z, s, var_s
+
+
+def _mann_kendall_s(y):
+    """
+    mann kendall S statistic and tie correction term for each row of y
+    :param y: np.array of shape (nsims, n_samples)
+    :return: s, ties (sum of t(t-1)(2t+5) over tied groups), each np.array of shape (nsims,)
+    """
+    n_sims, n_samples = y.shape
+    rows = np.arange(n_sims)
+
+    # dense ranks (ties share a rank) and tied group sizes from a single sort
+    order = np.argsort(y, axis=1, kind='stable')
+    sorted_y = np.take_along_axis(y, order, axis=1)
+    new_group = np.ones(y.shape, dtype=bool)
+    new_group[:, 1:] = sorted_y[:, 1:] != sorted_y[:, :-1]
+    dense = np.cumsum(new_group, axis=1)
+    group_sizes = np.bincount((dense - 1 + rows[:, np.newaxis] * n_samples).ravel(),
+                              minlength=n_sims * n_samples).reshape(n_sims, n_samples)
+    ties = (group_sizes * (group_sizes - 1) * (2 * group_sizes + 5)).sum(axis=1)
+
+    if n_samples <= _mk_pairwise_max_n:
+        s = np.zeros(n_sims, dtype=np.int64)
+        for k in range(1, n_samples):
+            s += np.sign(y[:, k:] - y[:, :-k]).sum(axis=1).astype(np.int64)
+        return s, ties
+
+    # inversion count via a binary indexed tree over the dense ranks, O(n log n) per row
+    ranks = np.empty_like(dense)
+    np.put_along_axis(ranks, order, dense, axis=1)
+    nbits = int(n_samples).bit_length() + 1
+    tree = np.zeros((n_sims, 2 * n_samples + 2), dtype=np.int64)  # overflow columns absorb out of range updates
+
+    def _prefix_count(idx):
+        total = np.zeros(n_sims, dtype=np.int64)
+        idx = idx.copy()
+        for _ in range(nbits):
+            total += tree[rows, idx]  # tree[:, 0] is always 0
+            idx -= idx & -idx
+        return total
+
+    s = np.zeros(n_sims, dtype=np.int64)
+    for j in range(n_samples):
+        r = ranks[:, j]
+        n_less = _prefix_count(r - 1)
+        n_less_equal = _prefix_count(r)
+        s += n_less - (j - n_less_equal)  # earlier values below x_j minus earlier values above x_j
+        idx = r.copy()
+        for _ in range(nbits):
+            tree[rows, idx] += 1
+            idx += idx & -idx
+            idx = np.minimum(idx, tree.shape[1] - 1)
+    return s, ties
+
+
+def _mpmk_candidate_breakpoints(n_samples, min_size, nparts, check_step, check_window=None):
+    """
+    candidate breakpoints for each of the nparts - 1 breakpoints of a multipart mann kendall test
+    :param n_samples: number of samples in the series
+    :param min_size: minimum number of samples in each part
+    :param nparts: number of parts
+    :param check_step: spacing between candidate breakpoints
+    :param check_window: None (check the full series) or a list of (wmin, wmax) tuples, one per breakpoint
+    :return: list of np.array of candidate breakpoints (len nparts - 1)
+    """
+    if check_window is None:
+        return [np.arange(min_size, n_samples - min_size + 1, check_step) for part in range(nparts - 1)]
+    assert len(check_window) == nparts - 1, f'check_window must have {nparts - 1} (wmin, wmax) entries'
+    return [np.arange(wmin, wmax + 1, check_step) for wmin, wmax in check_window]
+
+
+class _SegmentMannKendall:
+    """
+    mann kendall statistics for every candidate part of a multipart mann kendall test on a single series.
+    Part k runs from its start (0 or a candidate for breakpoint k - 1) to its end (a candidate for breakpoint k or the
+    end of the series).  The pairwise sign table is accumulated once so the S statistic of any part is a lookup:
+        S(a, b) = C(b, b) - C(a, b), where C(a, b) = sum of sign(x_j - x_i) for i < a and i < j < b
+    this replaces re-scanning every candidate segment (kendall_stats.MultiPartKendall) with O(n^2) work per series,
+    the breakpoint search is then a dynamic program over the parts rather than a search over every combination
+    """
+
+    def __init__(self, x, candidates, alpha, no_trend_alpha, min_size):
+        """
+        :param x: the series (1d)
+        :param candidates: list of np.array of candidate breakpoints (see _mpmk_candidate_breakpoints)
+        :param alpha: significance level for parts with an expected trend
+        :param no_trend_alpha: parts expected to have no trend are only accepted if p > no_trend_alpha
+        :param min_size: minimum number of samples in each part
+        """
+        x = np.asarray(x, dtype=float)
+        n_samples = len(x)
+        candidates = [np.atleast_1d(c).astype(int) for c in candidates]
+        self.candidates = candidates
+        self.nparts = len(candidates) + 1
+        self.part_starts = [np.array([0])] + candidates
+        self.part_ends = candidates + [np.array([n_samples])]
+        bounds = np.unique(np.concatenate([[0, n_samples]] + candidates))
+
+        # sweep the rows of the (upper triangular) sign table once, recording C(a, part ends) at each part start
+        rows_per_block = max(1, _mk_chunk_elements // max(n_samples, 1))
+        running = np.zeros(n_samples, dtype=np.int64)
+        cols = np.arange(n_samples)
+        diag = np.zeros(n_samples + 1, dtype=np.int64)  # C(b, b)
+        part_c = [np.zeros((len(st), len(en)), dtype=np.int64) for st, en in zip(self.part_starts, self.part_ends)]
+        prev = 0
+        for bound in bounds:
+            for i0 in range(prev, bound, rows_per_block):
+                i1 = min(i0 + rows_per_block, bound)
+                signs = np.sign(x[np.newaxis, :] - x[i0:i1, np.newaxis])
+                signs[cols[np.newaxis, :] <= np.arange(i0, i1)[:, np.newaxis]] = 0
+                running += signs.sum(axis=0).astype(np.int64)
+            prev = bound
+            cum = np.concatenate([[0], np.cumsum(running)])
+            diag[bound] = cum[bound]
+            for part, (starts, ends) in enumerate(zip(self.part_starts, self.part_ends)):
+                idx = np.searchsorted(starts, bound)
+                if idx < len(starts) and starts[idx] == bound:
+                    part_c[part][idx] = cum[ends]
+
+        crit = stats.norm.ppf(1 - alpha / 2)
+        self.z = []
+        self._part_ok = []
+        for starts, ends, c_table in zip(self.part_starts, self.part_ends, part_c):
+            s = diag[ends][np.newaxis, :] - c_table
+            sizes = ends[np.newaxis, :] - starts[:, np.newaxis]
+            var_s = (sizes * (sizes - 1) * (2 * sizes + 5) - self._tie_table(x, starts, ends)) / 18
+            with np.errstate(divide='ignore', invalid='ignore'):
+                z = np.where(s == 0, 0., (s - np.sign(s)) / np.sqrt(var_s))
+            p = 2 * stats.norm.sf(np.abs(z))
+            h = np.abs(z) > crit
+            valid = sizes >= min_size
+            self.z.append(z)
+            self._part_ok.append({
+                1: valid & h & (z > 0),
+                -1: valid & h & (z < 0),
+                0: valid & (p > no_trend_alpha),
+            })
+
+    @staticmethod
+    def _tie_table(x, starts, ends):
+        """
+        tie correction term (sum of t(t-1)(2t+5) over tied groups) for every part [start, end), each start is swept
+        forward in one vectorised pass
+        """
+        n_samples = len(x)
+        unique, group = np.unique(x, return_inverse=True)
+        out = np.zeros((len(starts), len(ends)))
+        if len(unique) == n_samples:  # no ties
+            return out
+        # number of earlier occurrences of the same value at each position
+        order = np.argsort(group, kind='stable')
+        first = np.searchsorted(group[order], group[order], side='left')
+        occ_before = np.empty(n_samples, dtype=np.int64)
+        occ_before[order] = np.arange(n_samples) - first
+
+        def g(t):
+            return t * (t - 1) * (2 * t + 5)
+
+        for i, a in enumerate(starts):
+            count_before_a = np.bincount(group[:a], minlength=len(unique))
+            c = occ_before[a:] - count_before_a[group[a:]]
+            increment = np.concatenate([[0], np.cumsum(g(c + 1) - g(c))])
+            use = ends > a
+            out[i, use] = increment[ends[use] - a]
+        return out
+
+    def any_acceptable(self, expect_part):
+        """
+        dynamic programming over the parts: a candidate for breakpoint k is reachable if some reachable candidate for
+        breakpoint k - 1 gives an acceptable part k, O(nparts * ncandidates^2) rather than testing every combination
+        :param expect_part: expected trend in each part (1 increasing, -1 decreasing, 0 no trend)
+        :return: bool, True if any breakpoint combination meets the expected trend in every part
+        """
+        expect_part = np.atleast_1d(expect_part)
+        reach = self._part_ok[0][int(expect_part[0])][0]
+        for part in range(1, self.nparts):
+            ok = self._part_ok[part][int(expect_part[part])]
+            reach = (reach[:, np.newaxis] & ok).any(axis=0)
+            if not reach.any():
+                return False
+        return bool(reach[0])
+
+    def get_maxz_breakpoints(self, expect_part):
+        """
+        the acceptable breakpoint combinations with the maximum summed abs(z) across the parts with an expected trend,
+        found by dynamic programming over the parts (scores are summed in part order so ties are exact), all tied
+        best combinations are returned
+        :param expect_part: expected trend in each part (1 increasing, -1 decreasing, 0 no trend)
+        :return: None if no acceptable breakpoints else np.array of shape (nbest, nparts - 1)
+        """
+        expect_part = np.atleast_1d(expect_part)
+        part_scores = []
+        for part, expect in enumerate(expect_part):
+            score = np.abs(self.z[part]) if expect != 0 else np.zeros(self.z[part].shape)
+            part_scores.append(np.where(self._part_ok[part][int(expect)], score, -np.inf))
+
+        # best[k][j]: best score of parts 0..k with breakpoint k at candidate j
+        best = [0. + part_scores[0][0]]
+        for part in range(1, self.nparts):
+            best.append((best[-1][:, np.newaxis] + part_scores[part]).max(axis=0))
+        if not np.isfinite(best[-1][0]):
+            return None
+
+        # backtrack every tied path
+        paths = [[0]]  # index into the ends of the last part
+        for part in range(self.nparts - 1, 0, -1):
+            new_paths = []
+            for path in paths:
+                j = path[0]
+                prev = np.where(best[part - 1] + part_scores[part][:, j] == best[part][j])[0]
+                new_paths.extend([[i] + path for i in prev])
+            paths = new_paths
+        paths = np.array(paths)[:, :-1]
+        paths = paths[np.lexsort(paths.T[::-1])]
+        return np.stack([c[paths[:, k]] for k, c in enumerate(self.candidates)], axis=1)
+
+
+# number of permutations generated (and seeded) together when building the pettitt null distribution
+_pettitt_null_block = 500
+# in memory cache of the pettitt null distributions {(n_samples, seed): K values in generation order}
+_pettitt_null_cache = {}
+
+
+def _pettitt_k(ranks):
+    """
+    pettitt K statistic (max abs(U_t)) and change point for each row of a rank matrix
+    :param ranks: np.array of shape (nsims, n_samples) of within row ranks (1 to n_samples)
+    :return: K (nsims,), change point (nsims,) as per pyhomogeneity (1 based index of the end of the first segment)
+    """
+    n_samples = ranks.shape[1]
+    k = np.arange(1, n_samples)
+    u = np.abs(2 * np.cumsum(ranks, axis=1)[:, :-1] - k * (n_samples + 1))
+    return u.max(axis=1), u.argmax(axis=1) + 1
+
+
+def _get_pettitt_null(n_samples, nsims, seed, cache_dir=None, sort=True):
+    """
+    permutation null distribution of the pettitt K statistic for a series of n_samples. K only depends on the ranks of
+    the data so (for continuous data) the null is the same for every series of the same length.  The permutations are
+    generated in blocks seeded by (seed, n_samples, block) so a longer null always extends a shorter one.
+    :param n_samples: number of samples in the series
+    :param nsims: number of permutations
+    :param seed: int seed
+    :param cache_dir: None or Path, directory for the on disk cache
+    :param sort: bool, if True sort the null (for _pettitt_null_pvalue) otherwise return it in generation order
+                 (used by _sequential_pettitt_pvalue, which extends the null block by block)
+    :return: np.array of nsims K values
+    """
+    key = (n_samples, seed)
+    null = _pettitt_null_cache.get(key)
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = Path(cache_dir).joinpath(f'pettitt_null_n{n_samples}_seed{seed}.npy')
+        if (null is None or len(null) < nsims) and cache_path.exists():
+            try:
+                null = np.load(cache_path)
+                assert null.ndim == 1 and len(null) % _pettitt_null_block == 0
+            except Exception:
+                # unreadable (e.g. truncated) cache file, the null is recomputed and the file replaced
+                warnings.warn(f'could not read pettitt null cache {cache_path}, recomputing')
+                null = _pettitt_null_cache.get(key)
+
+    if null is None or len(null) < nsims:
+        null = np.zeros(0) if null is None else null
+        nblocks = -(-nsims // _pettitt_null_block)
+        new = []
+        for block in range(len(null) // _pettitt_null_block, nblocks):
+            rng = np.random.default_rng([seed, n_samples, block])
+            ranks = rng.random((_pettitt_null_block, n_samples)).argsort(axis=1).argsort(axis=1) + 1
+            new.append(_pettitt_k(ranks)[0].astype(float))
+        null = np.concatenate([null[:len(null) // _pettitt_null_block * _pettitt_null_block]] + new)
+        if cache_path is not None:
+            # write to a unique temporary file and then move it into place, so processes sharing the cache directory
+            # never read a partially written file
+            tmp_path = cache_path.with_name(f'tmp_{os.getpid()}_{cache_path.name}')
+            np.save(tmp_path, null)
+            os.replace(tmp_path, cache_path)
+    _pettitt_null_cache[key] = null
+    if sort:
+        return np.sort(null[:nsims])
+    return null[:nsims].copy()
+
+
+def _batch_pettitt(y, null_k=None):
+    """
+    vectorised pettitt test (as per pyhomogeneity.pettitt_test) of every row of y, the rows are ranked at once and
+    U_t for every candidate change point is a cumulative sum of the ranks
+    :param y: np.array of shape (nsims, n_samples)
+    :param null_k: sorted null distribution of K for n_samples (see _get_pettitt_null) or None (p not calculated)
+    :return: K (nsims,), change point (nsims,), p value (nsims,) or None
+    """
+    y = np.atleast_2d(y)
+    assert np.isfinite(y).all(), 'y must not contain nan or inf values'
+    k, cp = _pettitt_k(stats.rankdata(y, axis=1))
+    if null_k is None:
+        return k, cp, None
+    return k, cp, _pettitt_null_pvalue(null_k, k)
+
+
+def _pettitt_null_pvalue(null_k, k):
+    """
+    monte carlo p value of the pettitt test, the fraction of the null greater than k (as per pyhomogeneity)
+    :param null_k: sorted null distribution of K (see _get_pettitt_null)
+    :param k: K statistic(s)
+    :return: p value(s)
+    """
+    return (len(null_k) - np.searchsorted(null_k, k, side='right')) / len(null_k)
+
+
+# number of null permutations each undecided series is first compared to in the sequential pettitt p value, the step
+# doubles each time so a series near the threshold takes O(log(nsims_pettit)) steps
+_pettitt_sequential_block = 50
+
+
+def _sequential_pettitt_pvalue(k, n_samples, nsims, seed, alpha, error, cache_dir=None):
+    """
+    sequential (Besag-Clifford style) monte carlo p values, each series is compared to successive blocks of the null
+    until the Wilson interval of its p value lies entirely above or below alpha (or nsims permutations are used).  The
+    null is generated lazily (see _get_pettitt_null), a further _pettitt_null_block permutations are only generated
+    while some series is still undecided
+    :param k: K statistic for each series (nsims,)
+    :param n_samples: number of samples in the series
+    :param nsims: maximum number of permutations
+    :param seed: int seed of the null
+    :param alpha: the significance level the p value is decided against
+    :param error: two sided probability that the interval does not contain the true p value
+    :param cache_dir: None or Path, directory for the on disk cache of the null
+    :return: p value (nsims,), number of null permutations each series was compared to (nsims,), number of null
+             permutations generated (the length of the null used)
+    """
+    k = np.atleast_1d(k)
+    z = stats.norm.ppf(1 - error / 2)
+    exceed = np.zeros(len(k), dtype=int)
+    nperms = np.zeros(len(k), dtype=int)
+    active = np.arange(len(k))
+    null_k = np.zeros(0)
+    start, step = 0, _pettitt_sequential_block
+    while len(active) > 0 and start < nsims:
+        stop = min(start + step, nsims)
+        if stop > len(null_k):
+            nnull = min(nsims, -(-stop // _pettitt_null_block) * _pettitt_null_block)
+            null_k = _get_pettitt_null(n_samples, nnull, seed, cache_dir, sort=False)
+        null_block = null_k[start:stop]
+        exceed[active] += (null_block[np.newaxis, :] > k[active, np.newaxis]).sum(axis=1)
+        nperms[active] += len(null_block)
+        lower, upper = _wilson_interval(exceed[active], nperms[active], z)
+        active = active[(lower <= alpha) & (upper >= alpha)]
+        start, step = stop, step * 2
+    with np.errstate(invalid='ignore'):
+        return exceed / nperms, nperms, len(null_k)
+
+
+def _wilson_interval(successes, trials, z):
+    """
+    Wilson score interval for a binomial proportion
+    :param successes: number of successes
+    :param trials: number of trials
+    :param z: standard normal quantile of the interval (e.g. 1.96 for a 95% interval)
+    :return: lower, upper
+    """
+    successes = np.asarray(successes, dtype=float)
+    trials = np.asarray(trials, dtype=float)
+    p_hat = successes / trials
+    denom = 1 + z ** 2 / trials
+    center = (p_hat + z ** 2 / (2 * trials)) / denom
+    half_width = z * np.sqrt(p_hat * (1 - p_hat) / trials + z ** 2 / (4 * trials ** 2)) / denom
+    return center - half_width, center + half_width
+
+
+@functools.lru_cache(maxsize=256)
+def _bepfm_age_dist(mrt, mrt_p1, frac_p1, f_p1, f_p2, precision):
+    """
+    age distribution of the binary exponential piston flow model, cached as it only depends on the age parameters
+    (which are shared by many runs) and is relatively slow to compute
+    :return: mrt, mrt_p2, age_step, ages, age_fractions (ages and age_fractions are read only)
+    """
+    mrt, mrt_p2 = check_age_inputs(mrt=mrt, mrt_p1=mrt_p1, mrt_p2=None, frac_p1=frac_p1,
+                                   precision=precision, f_p1=f_p1, f_p2=f_p2)
+    # make cdf of age
+    age_step, ages, age_fractions = make_age_dist(mrt, mrt_p1, mrt_p2, frac_p1, precision, f_p1, f_p2, start=np.nan)
+
+    ages = np.arange(0, np.nanmax([mrt_p1, mrt_p2]) * 5, age_step).round(precision)  # approximately monthly steps
+    age_cdf = binary_exp_piston_flow_cdf(ages, mrt_p1, mrt_p2, frac_p1, f_p1, f_p2)
+    age_fractions = np.diff(age_cdf, prepend=0)
+    ages.flags.writeable = False
+    age_fractions.flags.writeable = False
+    return mrt, mrt_p2, age_step, ages, age_fractions
+
+
+class RaggedTrueConc:
+    """
+    a collection of true concentration time series of (possibly) different lengths held as one flat array of values
+    and the offsets of each series (series i is values[offsets[i]:offsets[i + 1]]), so the collection can be passed
+    to the multiprocessing workers as a single buffer.  Empty series are returned as None (i.e. runs that do not use
+    the pass_true_conc mrt_model).
+
+    The collection can also be stored on disk (see save, load and create) as a directory holding values.npy (float64)
+    and offsets.npy (int64), which lets regional runs use more series than fit in memory: a loaded store is memory
+    mapped and the multiprocessing workers open the store themselves, reading only the series of their runs.  The
+    store also holds digests.npy, the digest of each series (see compute_digests), which mulitprocess_power_calcs uses
+    to condense identical series and as the result cache key without reading the series in the main process
+    """
+    values_name = 'values.npy'
+    offsets_name = 'offsets.npy'
+    digests_name = 'digests.npy'
+
+    def __init__(self, values, offsets, path=None, digests=None):
+        """
+        :param values: 1d array of the concatenated series
+        :param offsets: 1d integer array of len(series) + 1, the start of each series and the end of the last
+        :param path: None or the directory the collection is stored in (set by load and create)
+        :param digests: None or uint8 array (len(series), 16) of the digest of each series (see compute_digests)
+        """
+        values = np.asanyarray(values, dtype=float)  # keeps memory mapped values as np.memmap
+        offsets = np.asarray(offsets)
+        assert values.ndim == 1, 'values must be 1d'
+        assert offsets.ndim == 1 and len(offsets) > 0 and pd.api.types.is_integer_dtype(offsets), (
+            'offsets must be a 1d integer array')
+        assert offsets[0] == 0 and offsets[-1] == len(values), 'offsets must start at 0 and end at len(values)'
+        assert (np.diff(offsets) >= 0).all(), 'offsets must be non-decreasing'
+        if digests is not None:
+            digests = np.asarray(digests, dtype=np.uint8)
+            assert digests.shape == (len(offsets) - 1, _true_conc_digest_size), (
+                f'digests must have shape {(len(offsets) - 1, _true_conc_digest_size)} got {digests.shape}')
+        self.values = values
+        self.offsets = offsets.astype(np.int64, copy=False)
+        self.path = None if path is None else Path(path)
+        self.digests = digests
+
+    @classmethod
+    def from_list(cls, series):
+        """
+        :param series: list (or array) of 1d arrays or None
+        :return: RaggedTrueConc
+        """
+        series = [np.zeros(0) if ts is None else np.atleast_1d(np.asarray(ts, dtype=float)) for ts in series]
+        for ts in series:
+            assert ts.ndim == 1, 'each true concentration series must be 1d'
+        offsets = np.zeros(len(series) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(ts) for ts in series])
+        values = np.concatenate(series) if len(series) > 0 else np.zeros(0)
+        return cls(values, offsets)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        if start == stop:
+            return None
+        return self.values[start:stop]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def series_digest(self, i):
+        """
+        :param i: series index
+        :return: bytes digest of series i (see compute_digests) or None for an empty series
+        """
+        assert self.digests is not None, 'the collection has no digests, see compute_digests'
+        if self.offsets[i] == self.offsets[i + 1]:
+            return None
+        return self.digests[i].tobytes()
+
+    def _series_digests(self):
+        digests = np.zeros((len(self), _true_conc_digest_size), dtype=np.uint8)
+        for i, ts in enumerate(self):
+            if ts is not None:
+                digests[i] = np.frombuffer(_true_conc_digest(ts), dtype=np.uint8)
+        return digests
+
+    def compute_digests(self):
+        """
+        compute the digest of each series (rounded to 6 decimals) and, for an on disk collection, write them to the
+        store (digests.npy).  save computes the digests itself, a store filled after create must call this once the
+        values are written (otherwise mulitprocess_power_calcs does not condense identical series of the store and
+        does not use the result cache)
+        :return: uint8 array (len(series), 16)
+        """
+        self.digests = self._series_digests()
+        if self.path is not None:
+            if isinstance(self.values, np.memmap):
+                self.values.flush()
+            np.save(self.path.joinpath(self.digests_name), self.digests)
+        return self.digests
+
+    def save(self, path):
+        """
+        save the collection (and the digest of each series) to a directory (see load)
+        :param path: directory
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path.joinpath(self.values_name), self.values)
+        np.save(path.joinpath(self.offsets_name), self.offsets)
+        digests = self.digests if self.digests is not None else self._series_digests()
+        np.save(path.joinpath(self.digests_name), digests)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """
+        load a collection saved by save (or create, or written by another program with the same layout)
+        :param path: directory holding values.npy, offsets.npy and (optionally) digests.npy
+        :param mmap_mode: passed to np.load, 'r' (the default) memory maps the values so series are only read from
+                          disk when used, None reads the values into memory
+        :return: RaggedTrueConc
+        """
+        path = Path(path)
+        values = np.load(path.joinpath(cls.values_name), mmap_mode=mmap_mode)
+        assert values.dtype == np.float64, f'values must be float64 got {values.dtype}'
+        offsets = np.load(path.joinpath(cls.offsets_name))
+        digests = None
+        if path.joinpath(cls.digests_name).exists():
+            digests = np.load(path.joinpath(cls.digests_name))
+        return cls(values, offsets, path=path, digests=digests)
+
+    @classmethod
+    def create(cls, path, lengths):
+        """
+        create an on disk collection to be filled series by series without holding the values in memory e.g.:
+
+            store = RaggedTrueConc.create(path, lengths)
+            for i, ts in enumerate(series_generator):
+                store.values[store.offsets[i]:store.offsets[i + 1]] = ts
+            store.compute_digests()  # flushes the values
+
+        :param path: directory
+        :param lengths: the length of each series (0 for None)
+        :return: RaggedTrueConc with writable memory mapped values (filled with nan)
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        lengths = np.asarray(lengths)
+        assert lengths.ndim == 1 and (lengths >= 0).all(), 'lengths must be a 1d array of non-negative integers'
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        np.save(path.joinpath(cls.offsets_name), offsets)
+        values = np.lib.format.open_memmap(path.joinpath(cls.values_name), mode='w+', dtype=np.float64,
+                                           shape=(int(offsets[-1]),))
+        values[:] = np.nan
+        return cls(values, offsets, path=path)
+
+    def _to_worker_spec(self):
+        """
+        spec for the multiprocessing workers to attach to the values (see _attach), on disk collections are opened by
+        the workers, otherwise the values are copied into shared memory
+        :return: None or the SharedMemory (the caller must close and unlink it), spec
+        """
+        if self.path is not None:
+            if isinstance(self.values, np.memmap):
+                self.values.flush()
+            return None, ('path', str(self.path))
+        shm = shared_memory.SharedMemory(create=True, size=max(self.values.nbytes, 1))
+        np.ndarray(self.values.shape, dtype=float, buffer=shm.buf)[:] = self.values
+        return shm, ('shared_memory', shm.name, len(self.values), self.offsets)
+
+    @classmethod
+    def _attach(cls, spec):
+        """
+        attach to the values from _to_worker_spec
+        :return: None or the SharedMemory (which must be kept open while the values are used), read only
+                 RaggedTrueConc
+        """
+        if spec[0] == 'path':
+            return None, cls.load(spec[1], mmap_mode='r')
+        _, name, nvalues, offsets = spec
+        shm = shared_memory.SharedMemory(name=name)
+        values = np.ndarray((nvalues,), dtype=float, buffer=shm.buf)
+        values.flags.writeable = False
+        return shm, cls(values, offsets)
+
+
+_true_conc_decimals = 6  # decimals the true concentration series are rounded to before hashing
+_true_conc_digest_size = 16
+
+
+def _true_conc_digest(true_conc_ts, decimals=_true_conc_decimals):
+    """
+    digest of a true concentration time series rounded to decimals
+    :param true_conc_ts: 1d array
+    :param decimals: number of decimals to round to
+    :return: bytes
+    """
+    true_conc_ts = np.round(np.asarray(true_conc_ts, dtype=float), decimals) + 0.  # + 0. normalises -0. to 0.
+    return hashlib.blake2b(true_conc_ts.tobytes(), digest_size=_true_conc_digest_size).digest()
+
+
+def _package_version():
+    """
+    installed version of gw_detect_power (part of the result cache key)
+    """
+    try:
+        return importlib.metadata.version('gw_detect_power')
+    except importlib.metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def _result_to_json(val):
+    """
+    json default for the values of a cached power_calc result, numpy scalars are stored as python scalars
+    :param val: value that json cannot serialise
+    :return: python scalar
+    """
+    if isinstance(val, np.generic):
+        return val.item()
+    raise TypeError(f'cannot cache a result value of type {type(val)}')
+
+
+class _PowerResultCache:
+    """
+    persistent sqlite cache of power_calc results (as dictionaries) keyed by a hash of the inputs, see
+    DetectionPowerCalculator result_cache_path.  The results are stored as json text (never pickled) so reading a
+    shared cache file cannot execute code
+    """
+
+    def __init__(self, path, max_entries=None, max_age_days=None):
+        """
+        :param path: path to the sqlite file
+        :param max_entries: None or int, maximum number of results kept (least recently used are evicted)
+        :param max_age_days: None or float, results older than this are evicted
+        """
+        assert max_entries is None or (isinstance(max_entries, int) and max_entries > 0), (
+            'max_entries must be None or a positive integer')
+        assert max_age_days is None or max_age_days > 0, 'max_age_days must be None or greater than 0'
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        with closing(self._connect()) as conn, conn:
+            # the results table of earlier versions held pickled results, it is dropped unread
+            conn.execute('DROP TABLE IF EXISTS results')
+            conn.execute('CREATE TABLE IF NOT EXISTS power_results '
+                         '(key TEXT PRIMARY KEY, result TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    @property
+    def stats(self):
+        with closing(self._connect()) as conn:
+            nentries = conn.execute('SELECT COUNT(*) FROM power_results').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'evicted': self.evicted, 'entries': nentries}
+
+    def get_many(self, keys, chunk_size=500):
+        """
+        :param keys: list of keys
+        :param chunk_size: number of keys per query
+        :return: dict of {key: result} for the cached keys
+        """
+        keys = list(dict.fromkeys(keys))
+        out = {}
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            for i in range(0, len(keys), chunk_size):
+                chunk = keys[i:i + chunk_size]
+                marks = ','.join('?' * len(chunk))
+                rows = conn.execute(f'SELECT key, result FROM power_results WHERE key IN ({marks})',
+                                    chunk).fetchall()
+                out.update({key: json.loads(result) for key, result in rows})
+                conn.execute(f'UPDATE power_results SET last_used = ? WHERE key IN ({marks})', [now] + chunk)
+        self.hits += len(out)
+        self.misses += len(keys) - len(out)
+        return out
+
+    def put_many(self, results):
+        """
+        :param results: dict of {key: result}
+        """
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.executemany('INSERT OR REPLACE INTO power_results VALUES (?, ?, ?, ?)',
+                             [(key, json.dumps(result, default=_result_to_json), now, now)
+                              for key, result in results.items()])
+
+    def evict(self):
+        """
+        evict results older than max_age_days and then the least recently used results beyond max_entries
+        """
+        with closing(self._connect()) as conn, conn:
+            if self.max_age_days is not None:
+                cur = conn.execute('DELETE FROM power_results WHERE created < ?',
+                                   (time.time() - self.max_age_days * 86400,))
+                self.evicted += cur.rowcount
+            if self.max_entries is not None:
+                cur = conn.execute('DELETE FROM power_results WHERE key IN (SELECT key FROM power_results '
+                                   'ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+                self.evicted += cur.rowcount
+
+
+def _iter_checkpoint(checkpoint_dir):
+    """
+    read the batches saved by _write_checkpoint_batch one at a time
+    :param checkpoint_dir: path to the checkpoint directory
+    :return: generator of pd.DataFrame of results with a run_key column
+    """
+    checkpoint_dir = Path(checkpoint_dir)
+    paths = sorted(checkpoint_dir.glob('batch_*.pkl')) if checkpoint_dir.exists() else []
+    for path in paths:
+        yield pd.read_pickle(path)
+
+
+def _read_checkpoint(checkpoint_dir):
+    """
+    read the results saved by _write_checkpoint_batch
+    :param checkpoint_dir: path to the checkpoint directory
+    :return: None (no checkpoint) or pd.DataFrame of results with a run_key column
+    """
+    batches = list(_iter_checkpoint(checkpoint_dir))
+    if len(batches) == 0:
+        return None
+    return pd.concat(batches, ignore_index=True)
+
+
+def _write_checkpoint_batch(checkpoint_dir, batch):
+    """
+    write a batch of results to the checkpoint directory, the batch is written to a temporary file and then moved so
+    an interrupted write never leaves a partial batch
+    :param checkpoint_dir: path to the checkpoint directory
+    :param batch: pd.DataFrame of results with a run_key column
+    """
+    checkpoint_dir = Path(checkpoint_dir)
+    checkpoint_dir.mkdir(parents=True, exist_ok=True)
+    nbatch = len(list(checkpoint_dir.glob('batch_*.pkl')))
+    tmp_path = checkpoint_dir.joinpath(f'tmp_{os.getpid()}.pkl')
+    batch.to_pickle(tmp_path)
+    os.replace(tmp_path, checkpoint_dir.joinpath(f'batch_{nbatch:06d}.pkl'))
+
+
+# measured run times, see timetest.py
+_timeit_results_path = Path(__file__).parent.joinpath('timeit_test_results.txt')
+_timeit_nsims = 10  # nsims used in timetest.py
+
+
+_int_missing = np.iinfo(np.int64).min  # missing (None) value of the integer inputs, see _adjust_shape
+
+
+def _run_value(val, is_int=False):
+    """
+    convert a value of an array from DetectionPowerCalculator._adjust_shape to a power_calc kwarg
+    :param val: float (nan for None) or, if is_int, int64 (_int_missing for None)
+    :param is_int: bool, return an int
+    :return: None, int or float
+    """
+    if is_int:
+        return None if val == _int_missing else int(val)
+    if np.isnan(val):
+        return None
+    return float(val)
+
+
+def _is_present(values):
+    """
+    :param values: array from DetectionPowerCalculator._adjust_shape
+    :return: boolean array, True where the value is not missing (None)
+    """
+    if pd.api.types.is_integer_dtype(values):
+        return values != _int_missing
+    return ~np.isnan(values)
+
+
+# numeric inputs and outputs of power_calc that may be None
+_result_float_columns = ('max_conc', 'max_conc_time', 'error', 'samp_years', 'samp_per_year', 'implementation_time',
+                         'initial_conc', 'target_conc', 'previous_slope', 'max_conc_lim', 'min_conc_lim', 'mrt',
+                         'mrt_p1', 'frac_p1', 'f_p1', 'f_p2', 'mrt_p2', 'seed', 'prev_slope', 'min_conc')
+
+
+def _is_result_number(val):
+    """
+    whether a power_calc result value can be held in a preallocated float column (None is held as NaN)
+    :param val: result value
+    :return: bool
+    """
+    return val is None or (pd.api.types.is_number(val) and not isinstance(val, (complex, np.complexfloating)))
+
+
+def _new_result_column(key, val, n):
+    """
+    preallocate a result column for a batch of power_calc runs, numeric columns (and the known numeric inputs, which
+    may be None) are float64 filled with NaN, anything else is an object column filled with None
+    :param key: column name
+    :param val: first value of the column
+    :param n: number of runs in the batch
+    :return: np.array
+    """
+    if key in _result_float_columns or (val is not None and not isinstance(val, (bool, np.bool_))
+                                         and _is_result_number(val)):
+        return np.full(n, np.nan)
+    return np.full(n, None, dtype=object)
+
+
+def _run_nsamples(runs):
+    """
+    number of samples in the true concentration time series of each run
+    :param runs: list of kwargs for power_calc
+    :return: np.array of int
+    """
+    nsamples = []
+    for r in runs:
+        if r.get('true_conc_ts') is not None:
+            nsamples.append(len(r['true_conc_ts']))
+        elif r.get('samp_years') is not None and r.get('samp_per_year') is not None:
+            nsamples.append(r['samp_years'] * r['samp_per_year'])
+        else:
+            nsamples.append(0)
+    return np.array(nsamples, dtype=float)
+
+
+class _RunCostModel:
+    """
+    predicted run time of power_calc from the significance mode, the number of samples and nsims.  The time per
+    simulation is interpolated (log-log in the number of samples) from the timetest.py measurements, and a scale
+    factor (an exponential moving average of observed / predicted time) is updated online as results come in.  The
+    scale is held per octave of the number of samples (falling back to the overall scale for octaves without
+    observations) so the online correction also fixes the shape of the cost curve, not only its level
+    """
+
+    def __init__(self, significance_mode, efficent_mode, nsims, smoothing=0.2):
+        """
+        :param significance_mode: significance mode of the calculator
+        :param efficent_mode: bool efficient mode of the calculator
+        :param nsims: number of simulations
+        :param smoothing: weight of the newest observation in the scale moving average
+        """
+        self.nsims = nsims
+        self.smoothing = smoothing
+        self.scale = 1.
+        self.bin_scale = {}
+        self._nsamples, self._times = np.array([1., 10.]), np.array([1e-5, 1e-4])  # linear in nsamples fallback
+        if _timeit_results_path.exists():
+            times = pd.read_csv(_timeit_results_path, index_col=[0, 1])
+            if significance_mode in times.columns:
+                times = times.xs(bool(efficent_mode), level=1)[significance_mode]
+                self._nsamples = times.index.values.astype(float)
+                self._times = times.values / _timeit_nsims
+
+    @staticmethod
+    def _bins(nsamples):
+        return np.floor(np.log2(np.maximum(np.asarray(nsamples, dtype=float), 1))).astype(int)
+
+    def predict(self, nsamples):
+        """
+        :param nsamples: np.array of the number of samples of each run
+        :return: np.array of predicted run times (seconds)
+        """
+        nsamples = np.asarray(nsamples, dtype=float)
+        scale = np.array([self.bin_scale.get(b, self.scale) for b in self._bins(nsamples)])
+        # below the measured range the (fixed) overhead dominates, so the time is not extrapolated
+        nsamples = np.maximum(nsamples, self._nsamples[0])
+        slope = np.diff(np.log(self._times)) / np.diff(np.log(self._nsamples))
+        idx = np.clip(np.searchsorted(self._nsamples, nsamples) - 1, 0, len(self._nsamples) - 2)
+        log_t = np.log(self._times[idx]) + slope[idx] * (np.log(nsamples) - np.log(self._nsamples[idx]))
+        return scale * self.nsims * np.exp(log_t)
+
+    def update(self, nsamples, predicted, observed):
+        """
+        update the scale factors from an observed run time, each octave of the number of samples is updated with a
+        weight of its share of the predicted time
+        :param nsamples: np.array of the number of samples of the observed runs
+        :param predicted: np.array of the predicted time (seconds) of the observed runs
+        :param observed: observed time (seconds) of all the observed runs
+        """
+        predicted = np.atleast_1d(np.asarray(predicted, dtype=float))
+        total = predicted.sum()
+        if not (total > 0 and observed > 0):
+            return
+        ratio = observed / total
+        bins = self._bins(np.atleast_1d(nsamples))
+        for b in np.unique(bins):
+            weight = predicted[bins == b].sum() / total
+            self.bin_scale[b] = self.bin_scale.get(b, self.scale) * ratio ** (self.smoothing * weight)
+        self.scale *= ratio ** self.smoothing
+
+
+def _cost_chunks(costs, pool_size, chunksize=None, max_chunksize=None, tasks_per_core=4, max_runs=1000):
+    """
+    group runs into multiprocessing tasks in order of decreasing cost, each task has about equal cost (so each
+    worker gets about tasks_per_core tasks) or a fixed number of runs (chunksize)
+    :param costs: np.array of the predicted cost of each run
+    :param pool_size: number of processes
+    :param chunksize: None or int, fixed number of runs per task
+    :param max_chunksize: None or int, additional maximum chunk size (e.g. the checkpoint batch)
+    :param tasks_per_core: target number of tasks per process
+    :param max_runs: maximum number of runs per task
+    :return: list of np.array of run indices, most expensive first
+    """
+    costs = np.asarray(costs, dtype=float)
+    order = np.argsort(-costs, kind='stable')
+    if chunksize is not None:
+        max_runs = chunksize
+    if max_chunksize is not None:
+        max_runs = min(max_runs, max_chunksize)
+    if chunksize is None:
+        sorted_costs = costs[order]
+        target = max(sorted_costs.sum() / (pool_size * tasks_per_core), np.finfo(float).tiny)
+        # chunk by the cost before each run, so a run costing more than target is a chunk on its own
+        chunk = np.floor((np.cumsum(sorted_costs) - sorted_costs) / target).astype(np.int64)
+    else:
+        chunk = np.zeros(len(costs), dtype=np.int64)
+    # split the chunks into at most max_runs runs
+    _, first = np.unique(chunk, return_index=True)
+    position = np.arange(len(chunk)) - np.repeat(first, np.diff(np.append(first, len(chunk))))
+    chunk, _ = pd.factorize(chunk * (len(chunk) + 1) + position // max_runs)
+    bounds = np.flatnonzero(np.diff(chunk)) + 1
+    return np.split(order, bounds)
+
+
+def _run_multiprocess(func, runs, logical=True, num_cores=None, logging_level=logging.INFO, calculator=None,
+                      shared_true_conc=None, callback=None, batch_size=None, chunksize=None):
     """
     count the number of processors and then instiute the runs of a function to
     :param func: function with one argument kwargs.
@@ -1242,7 +3219,18 @@ def _run_multiprocess(func, runs, logical=True, num_cores=None, logging_level=lo
     :param logging_level: logging level to use one of: logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR,
                           logging.CRITICAL more info https://docs.python.org/3/howto/logging.html
                           default is logging.INFO
-    :return:
+    :param calculator: None or a configured DetectionPowerCalculator (see DetectionPowerCalculator._worker_copy),
+                       if passed it is handed to (or, where processes are spawned, pickled once for) each process
+                       at start up (see _start_process), for use by func (e.g. _worker_power_calc_batch)
+    :param shared_true_conc: None or the spec from RaggedTrueConc._to_worker_spec, if passed each process attaches
+                             the true concentration series at start up (requires calculator)
+    :param callback: None or function, if not None then the results are collected as they complete (in any order)
+                     and passed to callback(list of results) every batch_size results, so the results are never
+                     all held in memory, and None is returned
+    :param batch_size: int, number of results per callback (only used with callback)
+    :param chunksize: None or int, number of runs sent to a process at once (only used with callback), if None as
+                      per map_async, pass 1 to dispatch the runs strictly in order
+    :return: list of results in the order of runs (None if callback is passed)
     """
     assert isinstance(num_cores, int) or num_cores is None
     multiprocessing.log_to_stderr(logging_level)
@@ -1253,20 +3241,74 @@ def _run_multiprocess(func, runs, logical=True, num_cores=None, logging_level=lo
 
     pool = multiprocessing.Pool(processes=pool_size,
                                 initializer=_start_process,
+                                initargs=() if calculator is None else (calculator, shared_true_conc),
                                 )
 
-    results = pool.map_async(func, runs)
-    pool_outputs = results.get()
+    if callback is None:
+        results = pool.map_async(func, runs)
+        pool_outputs = results.get()
+    else:
+        assert pd.api.types.is_integer(batch_size) and batch_size > 0, 'batch_size must be a positive integer'
+        if chunksize is None:
+            chunksize, extra = divmod(len(runs), pool_size * 4)  # as per map_async
+            chunksize += bool(extra)
+        batch = []
+        try:
+            for out in pool.imap_unordered(func, runs, chunksize=chunksize):
+                batch.append(out)
+                if len(batch) >= batch_size:
+                    callback(batch)
+                    batch = []
+            if len(batch) > 0:
+                callback(batch)
+        except BaseException:
+            pool.terminate()
+            raise
+        pool_outputs = None
     pool.close()  # no more tasks
     pool.join()
     return pool_outputs
 
 
-def _start_process():
+# the calculator and shared true concentration series of a multiprocessing worker, set by _start_process
+_worker_calculator = None
+_worker_true_conc = None
+_worker_shm = None
+
+
+def _worker_power_calc_batch(runs):
+    """
+    run a batch of power calcs with the calculator of this process
+    :param runs: list of kwargs for power_calc, runs with a true_conc_idx (and true_conc_ts=None) read their true
+                 concentration series from the shared series of this process
+    :return: pd.DataFrame with one row per run, run time (seconds)
+    """
+    t = time.perf_counter()
+    use_runs = []
+    for run in runs:
+        run = dict(run)
+        true_conc_idx = run.pop('true_conc_idx', None)
+        if run['true_conc_ts'] is None and true_conc_idx is not None and _worker_true_conc is not None:
+            run['true_conc_ts'] = _worker_true_conc[true_conc_idx]
+        use_runs.append(run)
+    block = _worker_calculator._power_calc_batch(use_runs)
+    return block, time.perf_counter() - t
+
+
+def _start_process(calculator=None, shared_true_conc=None):
     """
-    function to run at the start of each multiprocess sets the priority lower
+    function to run at the start of each multiprocess sets the priority lower and optionally sets the calculator
+    for the process, the calculator (and module level caches e.g. the pettitt null distributions and the age
+    distributions) then persist across the tasks run by the process
+    :param calculator: None or DetectionPowerCalculator (or subclass) as configured in the main process
+    :param shared_true_conc: None or the spec from RaggedTrueConc._to_worker_spec
     :return:
     """
+    global _worker_calculator, _worker_true_conc, _worker_shm
+    if calculator is not None:
+        _worker_calculator = calculator
+    if shared_true_conc is not None:
+        _worker_shm, _worker_true_conc = RaggedTrueConc._attach(shared_true_conc)
     print('Starting', multiprocessing.current_process().name)
     p = psutil.Process(os.getpid())
     # set to lowest priority, this is windows only, on Unix use ps.nice(19)
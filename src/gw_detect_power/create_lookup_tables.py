@@ -77,6 +77,7 @@ def no_lag_table(test_size=False):
             f_p2_vals=None,
             seed=5585,
             run=run_model,
+            canonicalize=True,  # equivalent (initial_conc, error) scenarios share one simulation
         )
         if outdata is None:
             return  # for testing the multiprocess setup
@@ -133,6 +134,7 @@ def piston_flow_lag_table(test_size=False):
                 f_p2_vals=None,
                 seed=5585,
                 run=run_model,
+                canonicalize=True,  # equivalent (initial_conc, error) scenarios share one simulation
             )
             if outdata is None:
                 continue  # for testing the multiprocess setup
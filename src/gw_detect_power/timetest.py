@@ -49,6 +49,10 @@ def timeit_test(methods=methods, ndata=ndata, efficency_modes=efficency_modes, n
 
     for nd, emode, method in itertools.product(ndata, efficency_modes, methods):
         print(f'testing: {method=}, {nd=}, {emode=}')
+        if method == 'pettitt-test':
+            # the pettitt null is built once per series length and cached, so it is built before timing, otherwise
+            # the first efficency mode timed includes the one off build
+            run_model(method, nd, emode)
         fn = f'run_model'
         t = timeit.timeit(f'{fn}("{method}", {nd}, {emode})',
                           setup='from {} import {}'.format(fname, fn),
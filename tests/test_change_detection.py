@@ -4,13 +4,20 @@ on: 17/07/23
 """
 import itertools
 import time
+import warnings
 from copy import deepcopy
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 from pathlib import Path
+import pytest
 from gw_detect_power import DetectionPowerCalculator
 
+try:
+    import kendall_stats
+except ImportError:
+    kendall_stats = None
+
 
 def print_myself():
     import traceback
@@ -1201,6 +1208,917 @@ def test_efficient_mode_mpmk():
         assert np.isclose(out_eff, out, rtol=2)
 
 
+def test_batch_linregress():
+    print_myself()
+    from scipy import stats
+    from gw_detect_power.change_detection_v2 import _batch_linregress
+    rng = np.random.default_rng(5548)
+    for n in [3, 10, 57, 500]:
+        x = np.arange(n)
+        y = rng.normal(size=(100, n)) + 0.01 * x
+        y[0] = 5.  # constant row
+        y[1] = x * 2.  # perfect fit
+        slopes, stderrs, pvals = _batch_linregress(x, y)
+        # a constant row has no trend (scipy gives a nan p-value)
+        assert slopes[0] == 0 and stderrs[0] == 0 and pvals[0] == 1, (slopes[0], stderrs[0], pvals[0])
+        for i, y0 in enumerate(y[1:], start=1):
+            o2 = stats.linregress(x, y0)
+            assert np.isclose(slopes[i], o2.slope, equal_nan=True), f'{n=} {i=}'
+            assert np.isclose(stderrs[i], o2.stderr, equal_nan=True), f'{n=} {i=}'
+            assert np.isclose(pvals[i], o2.pvalue, equal_nan=True, atol=1e-12), f'{n=} {i=}'
+
+
+def test_efficient_mode_constant():
+    print_myself()
+    # a constant true series can not be detected so efficient mode returns 0 power without running the simulations
+    for significance_mode in ['linear-regression', 'mann-kendall']:
+        for expect_slope in [-1, 'auto']:
+            dpc = DetectionPowerCalculator(significance_mode=significance_mode, nsims=100, efficent_mode=True,
+                                           expect_slope=expect_slope)
+            out = dpc.power_calc(idv='constant', error=0.5, true_conc_ts=np.full(30, 5.), mrt_model='pass_true_conc',
+                                 seed=5585)
+            assert out['power'] == 0, (significance_mode, expect_slope, out['power'])
+            assert dpc._test_counters.get('_efficient_mode_screened'), (significance_mode, expect_slope)
+
+
+def test_batch_mann_kendall():
+    print_myself()
+    from scipy.stats import norm
+    from gw_detect_power.change_detection_v2 import _batch_mann_kendall
+    rng = np.random.default_rng(5548)
+    for n in [3, 10, 50, 151, 400]:  # covers both the pairwise and inversion count paths
+        y = rng.normal(size=(20, n)).round(1) + np.linspace(0, 0.5, n)  # rounding forces ties
+        y[0] = 1.  # all ties
+        y[1] = np.arange(n)
+        trend, h, p, z, s, var_s = _batch_mann_kendall(y, alpha=0.05)
+        for i, y0 in enumerate(y):
+            s0 = sum(np.sign(y0[k + 1:] - y0[k]).sum() for k in range(n - 1))
+            unique, tp = np.unique(y0, return_counts=True)
+            var_s0 = (n * (n - 1) * (2 * n + 5) - np.sum(tp * (tp - 1) * (2 * tp + 5))) / 18
+            z0 = 0 if s0 == 0 else (s0 - np.sign(s0)) / np.sqrt(var_s0)
+            p0 = 2 * (1 - norm.cdf(abs(z0)))
+            assert s[i] == s0, f'{n=} {i=}'
+            assert np.isclose(var_s[i], var_s0), f'{n=} {i=}'
+            assert np.isclose(z[i], z0), f'{n=} {i=}'
+            assert np.isclose(p[i], p0, atol=1e-12), f'{n=} {i=}'
+            assert trend[i] == (np.sign(z0) if p0 < 0.05 else 0), f'{n=} {i=}'
+
+
+@pytest.mark.skipif(kendall_stats is None, reason='kendall_stats not installed')
+def test_batch_mann_kendall_vs_kendall_stats():
+    print_myself()
+    from gw_detect_power.change_detection_v2 import _batch_mann_kendall, _mann_kendall_s
+    rng = np.random.default_rng(3348)
+    for n in [3, 10, 50, 151, 400]:  # covers both the pairwise and inversion count paths
+        y = rng.normal(size=(10, n)) + np.linspace(0, 0.5, n)
+        y[5:] = y[5:].round(1)  # rounding forces ties
+        y[0] = 1.  # all ties
+        y[1] = np.arange(n)
+        y[2] = np.repeat(np.arange(n // 2 + 1), 2)[:n]  # every value tied in pairs
+        trend, h, p, z, s, var_s = _batch_mann_kendall(y, alpha=0.05)
+        s_only, _ = _mann_kendall_s(y)
+        assert np.array_equal(s_only, s), f'{n=}'
+        for i, y0 in enumerate(y):
+            mk = kendall_stats.MannKendall(data=y0, alpha=0.05)
+            assert s[i] == mk.s, f'{n=} {i=}'
+            assert np.isclose(var_s[i], mk.var_s), f'{n=} {i=}'
+            assert np.isclose(z[i], mk.z), f'{n=} {i=}'
+            assert np.isclose(p[i], mk.p, atol=1e-12), f'{n=} {i=}'
+            assert h[i] == mk.h and trend[i] == mk.trend, f'{n=} {i=}'
+
+
+def test_segment_mann_kendall():
+    print_myself()
+    from scipy.stats import norm
+    from gw_detect_power.change_detection_v2 import _SegmentMannKendall, _mpmk_candidate_breakpoints
+
+    def mann_kendall_z_p(x):
+        n = len(x)
+        s = sum(np.sign(x[k + 1:] - x[k]).sum() for k in range(n - 1))
+        unique, tp = np.unique(x, return_counts=True)
+        var_s = (n * (n - 1) * (2 * n + 5) - np.sum(tp * (tp - 1) * (2 * tp + 5))) / 18
+        z = 0 if s == 0 else (s - np.sign(s)) / np.sqrt(var_s)
+        return z, 2 * (1 - norm.cdf(abs(z)))
+
+    rng = np.random.default_rng(5548)
+    min_size = 5
+    for nparts, expect_part in zip([2, 3, 4], [[1, -1], [1, 0, -1], [1, 0, 0, -1]]):
+        for noise in [0, 0.3, 1.5]:
+            n = 45
+            true_conc = np.interp(np.arange(n), np.linspace(0, n - 1, nparts + 1), [0, 3, 3, 0, 0][:nparts + 1])
+            x = (true_conc + rng.normal(0, noise, n)).round(1)  # rounding forces ties
+            candidates = _mpmk_candidate_breakpoints(n, min_size, nparts, check_step=2)
+            mpmk = _SegmentMannKendall(x, candidates, alpha=0.05, no_trend_alpha=0.5, min_size=min_size)
+
+            # brute force every breakpoint combination
+            acceptable, scores = [], []
+            for combo in itertools.product(*candidates):
+                bounds = [0] + list(combo) + [n]
+                if np.any(np.diff(bounds) < min_size):
+                    continue
+                ok, score = True, 0
+                for part, expect in enumerate(expect_part):
+                    z, p = mann_kendall_z_p(x[bounds[part]:bounds[part + 1]])
+                    if expect == 0:
+                        ok &= p > 0.5
+                    else:
+                        ok &= (p < 0.05) and (np.sign(z) == expect)
+                        score += abs(z)
+                if ok:
+                    acceptable.append(combo)
+                    scores.append(score)
+            assert mpmk.any_acceptable(expect_part) == (len(acceptable) > 0), f'{nparts=} {noise=}'
+            best = mpmk.get_maxz_breakpoints(expect_part)
+            if len(acceptable) == 0:
+                assert best is None
+            else:
+                scores = np.array(scores)
+                expect_best = np.array(acceptable)[np.isclose(scores, scores.max(), rtol=1e-12)]
+                assert np.array_equal(np.sort(best, axis=0), np.sort(expect_best, axis=0)), f'{nparts=} {noise=}'
+
+
+@pytest.mark.skipif(kendall_stats is None, reason='kendall_stats not installed')
+def test_segment_mann_kendall_vs_kendall_stats():
+    print_myself()
+    from gw_detect_power.change_detection_v2 import _SegmentMannKendall, _mpmk_candidate_breakpoints
+    rng = np.random.default_rng(8564)
+    min_size = 5
+    for nparts, expect_part, peaks in zip([2, 3], [[1, -1], [1, 0, -1]], [[0, 3, 0], [0, 3, 3, 0]]):
+        for noise in [0, 0.3, 1.5]:
+            n = 60
+            true_conc = np.interp(np.arange(n), np.linspace(0, n - 1, nparts + 1), peaks)
+            x = (true_conc + rng.normal(0, noise, n)).round(1)  # rounding forces ties
+            # the full search and an efficient mode window around the middle of each part
+            mid = [int(n * (k + 1) / nparts) for k in range(nparts - 1)]
+            for check_step, window in [(1, None), (2, None), (1, [(m - 6, m + 6) for m in mid])]:
+                mpmk = kendall_stats.MultiPartKendall(data=x, nparts=nparts, expect_part=expect_part,
+                                                      min_size=min_size, alpha=0.05, no_trend_alpha=0.5,
+                                                      check_step=check_step, check_window=window)
+                candidates = _mpmk_candidate_breakpoints(n, min_size, nparts, check_step, check_window=window)
+                segment = _SegmentMannKendall(x, candidates, alpha=0.05, no_trend_alpha=0.5, min_size=min_size)
+                msg = f'{nparts=} {noise=} {check_step=} {window=}'
+                assert segment.any_acceptable(expect_part) == mpmk.acceptable_matches.any(), msg
+                expect = mpmk.get_maxz_breakpoints(raise_on_none=False)
+                got = segment.get_maxz_breakpoints(expect_part)
+                if expect is None:
+                    assert got is None, msg
+                else:
+                    expect = np.unique(np.array(expect).reshape(len(expect), -1), axis=0)
+                    assert np.array_equal(np.unique(got, axis=0), expect), msg
+
+
+def test_pettitt_null():
+    print_myself()
+    import tempfile
+    from pyhomogeneity import pettitt_test
+    from gw_detect_power.change_detection_v2 import _get_pettitt_null, _pettitt_null_pvalue, _pettitt_null_cache
+
+    # a longer null extends a shorter one and the disk cache reproduces the in memory cache
+    null_short = _get_pettitt_null(35, 700, 55)
+    _pettitt_null_cache.clear()
+    with tempfile.TemporaryDirectory() as tdir:
+        _get_pettitt_null(35, 1200, 55, tdir)
+        _pettitt_null_cache.clear()
+        assert np.array_equal(null_short, _get_pettitt_null(35, 700, 55, tdir))
+
+        # a corrupt cache file is recomputed (and replaced)
+        cache_path = Path(tdir).joinpath('pettitt_null_n35_seed55.npy')
+        cache_path.write_bytes(cache_path.read_bytes()[:100])
+        _pettitt_null_cache.clear()
+        assert np.array_equal(null_short, _get_pettitt_null(35, 700, 55, tdir))
+        assert len(np.load(cache_path)) == 1000
+        assert list(Path(tdir).glob('tmp_*')) == []
+
+        dpc = DetectionPowerCalculator(significance_mode='pettitt-test', pettitt_null_cache_dir=tdir)
+        assert isinstance(dpc.pettitt_null_cache_dir, Path)
+
+    # p values agree with pyhomogeneity's monte carlo p values (to monte carlo precision)
+    null = _get_pettitt_null(35, 20000, 55)
+    rng = np.random.default_rng(88)
+    np.random.seed(68)
+    for shift in [0, 0.5, 1]:
+        y = rng.normal(0, 1, 35)
+        y[20:] += shift
+        h, cp, p, U, mu = pettitt_test(y, sim=20000)
+        assert np.isclose(_pettitt_null_pvalue(null, U), p, atol=0.015), f'{shift=}'
+
+
+def test_batch_pettitt():
+    print_myself()
+    from pyhomogeneity import pettitt_test
+    from gw_detect_power.change_detection_v2 import _batch_pettitt, _get_pettitt_null, _pettitt_null_pvalue
+
+    rng = np.random.default_rng(654)
+    for n in [10, 37, 120]:
+        y = rng.normal(0, 1, (50, n))
+        y[:, n // 3:] += np.linspace(0, 2, 50)[:, np.newaxis]
+        y[:25] = y[:25].round(1)  # ties
+        null = _get_pettitt_null(n, 1000, 55)
+        k, cp, p = _batch_pettitt(y, null)
+        for i, y0 in enumerate(y):
+            h0, cp0, p0, k0, mu = pettitt_test(y0, sim=0)
+            assert np.isclose(k[i], k0), f'{n=} {i=}'
+            assert cp[i] == cp0, f'{n=} {i=}'
+            assert p[i] == _pettitt_null_pvalue(null, k0), f'{n=} {i=}'
+
+
+def test_sequential_pettitt():
+    print_myself()
+    true_conc = np.concatenate([np.zeros(25), np.ones(25)])
+    for error in [0.5, 1, 2, 4]:
+        outs = []
+        for sequential in [False, True]:
+            dpc = DetectionPowerCalculator(significance_mode='pettitt-test', nsims=500, nsims_pettit=2000,
+                                           efficent_mode=False, pettitt_sequential=sequential)
+            outs.append(dpc.power_calc(idv='pettitt', error=error, true_conc_ts=true_conc, mrt_model='pass_true_conc',
+                                       seed=558))
+        full, seq = outs
+        assert 'pettitt_perms_mean' not in full.index
+        assert abs(full['power'] - seq['power']) <= 1, f'{error=} {full["power"]=} {seq["power"]=}'
+        assert seq['pettitt_perms_mean'] < 2000, f'{error=}'
+        assert seq['pettitt_perms_mean'] <= seq['pettitt_perms_generated'] <= 2000, f'{error=}'
+
+    # the null is only generated while some series is undecided
+    from gw_detect_power.change_detection_v2 import (_sequential_pettitt_pvalue, _pettitt_null_cache,
+                                                     _get_pettitt_null, _pettitt_null_pvalue)
+    n, seed = 37, 9876
+    _pettitt_null_cache.pop((n, seed), None)
+    null = _get_pettitt_null(n, 20000, seed + 1)  # a different null, to pick clearly decided K values
+    k = np.array([null.max() + 1, np.median(null)])  # p = 0 and p ~ 0.5
+    p, nperms, generated = _sequential_pettitt_pvalue(k, n, 20000, seed, alpha=0.05, error=0.01)
+    assert generated == 500 and len(_pettitt_null_cache[(n, seed)]) == 500, generated
+    assert (nperms <= 500).all() and p[0] == 0 and p[1] > 0.05, (p, nperms)
+    # an undecided series (p ~ alpha) uses the whole null, which matches the fixed p value
+    k = np.quantile(null, 0.95)
+    p, nperms, generated = _sequential_pettitt_pvalue(k, n, 2000, seed, alpha=0.05, error=0.01)
+    assert generated == 2000 and nperms[0] == 2000
+    assert p[0] == _pettitt_null_pvalue(_get_pettitt_null(n, 2000, seed), k)
+
+
+def test_efficient_mode_pettitt():
+    print_myself()
+    step = np.concatenate([np.zeros(25), np.ones(25)])
+    dp = DetectionPowerCalculator(significance_mode='pettitt-test', nsims=500, efficent_mode=False)
+    dp_eff = DetectionPowerCalculator(significance_mode='pettitt-test', nsims=500, efficent_mode=True)
+    for error_val in [0.1, 0.5, 1, 2]:
+        eff = dp_eff.power_calc(idv='step', error=error_val, true_conc_ts=step, mrt_model='pass_true_conc')
+        non_eff = dp.power_calc(idv='step', error=error_val, true_conc_ts=step, mrt_model='pass_true_conc')
+        pd.testing.assert_series_equal(eff, non_eff), f'error: {error_val}'
+
+        # no change point in the noise free data
+        eff = dp_eff.power_calc(idv='flat', error=error_val, true_conc_ts=np.zeros_like(step),
+                                mrt_model='pass_true_conc')
+        assert eff['power'] == 0, f'error: {error_val}'
+
+
+def test_adaptive_nsims():
+    print_myself()
+    true_conc = np.linspace(10, 8, 30)
+    dp = DetectionPowerCalculator(significance_mode='linear-regression', nsims=1000)
+    # blocks reproduce the full run when the stopping rule is never met
+    dp_blocks = DetectionPowerCalculator(significance_mode='linear-regression', nsims=1000, adaptive_nsims=True,
+                                         adaptive_block=150, adaptive_ci_width=1e-6, adaptive_threshold=None)
+    dp_adapt = DetectionPowerCalculator(significance_mode='linear-regression', nsims=1000, adaptive_nsims=True,
+                                        adaptive_block=100, adaptive_ci_width=5., adaptive_threshold=80.)
+    for error_val in [0.1, 1.5, 3, 20]:
+        full = dp.power_calc(idv='lr', error=error_val, true_conc_ts=true_conc, mrt_model='pass_true_conc')
+        assert 'nsims_run' not in full.index
+        blocks = dp_blocks.power_calc(idv='lr', error=error_val, true_conc_ts=true_conc, mrt_model='pass_true_conc')
+        assert blocks['nsims_run'] == 1000
+        assert np.isclose(blocks['power'], full['power']), f'{error_val=}'
+        assert blocks['power_lower'] <= blocks['power'] <= blocks['power_upper']
+
+        adapt = dp_adapt.power_calc(idv='lr', error=error_val, true_conc_ts=true_conc, mrt_model='pass_true_conc')
+        assert adapt['nsims_run'] % 100 == 0 and adapt['nsims_run'] <= 1000
+        narrow = adapt['power_upper'] - adapt['power_lower'] <= 5.
+        decided = adapt['power_lower'] > 80. or adapt['power_upper'] < 80.
+        assert narrow or decided or adapt['nsims_run'] == 1000, f'{error_val=}'
+        if full['power'] in (0, 100):
+            assert adapt['nsims_run'] == 100, f'{error_val=}'
+
+
+def test_analytic_power_lr():
+    print_myself()
+    linear = np.linspace(10, 8, 30)
+    lagged = np.concatenate([np.full(10, 10.), np.linspace(10, 8, 10), np.full(20, 8.)])
+    hump = np.concatenate([np.linspace(8, 10, 10), np.linspace(10, 7, 30)])
+    for mode in ['linear-regression', 'linear-regression-from-max']:
+        mc = DetectionPowerCalculator(significance_mode=mode, nsims=4000, efficent_mode=False)
+        analytic = DetectionPowerCalculator(significance_mode=mode, analytic_power=True)
+        for name, true_conc in zip(['linear', 'lagged', 'hump'], [linear, lagged, hump]):
+            for error_val in [0, 0.5, 1.5, 3, 10]:
+                mc_out = mc.power_calc(idv=name, error=error_val, true_conc_ts=true_conc,
+                                       mrt_model='pass_true_conc')
+                an_out = analytic.power_calc(idv=name, error=error_val, true_conc_ts=true_conc,
+                                             mrt_model='pass_true_conc')
+                assert np.isclose(mc_out['power'], an_out['power'], atol=2.5), (f'{mode=} {name=} {error_val=} '
+                                                                               f'{mc_out["power"]=} '
+                                                                               f'{an_out["power"]=}')
+
+
+def test_analytic_power_mann_kendall():
+    print_myself()
+    linear = np.linspace(10, 8, 30)
+    lagged = np.concatenate([np.full(10, 10.), np.linspace(10, 8, 10), np.full(20, 8.)])
+    hump = np.concatenate([np.linspace(8, 10, 10), np.linspace(10, 7, 30)])
+    for mode in ['mann-kendall', 'mann-kendall-from-max']:
+        mc = DetectionPowerCalculator(significance_mode=mode, nsims=4000, efficent_mode=False)
+        analytic = DetectionPowerCalculator(significance_mode=mode, analytic_power=True)
+        for name, true_conc in zip(['linear', 'lagged', 'hump'], [linear, lagged, hump]):
+            for error_val in [0, 0.5, 1.5, 3, 10]:
+                mc_out = mc.power_calc(idv=name, error=error_val, true_conc_ts=true_conc,
+                                       mrt_model='pass_true_conc')
+                an_out = analytic.power_calc(idv=name, error=error_val, true_conc_ts=true_conc,
+                                             mrt_model='pass_true_conc')
+                # normal approximation, so a looser tolerance than the linear regression
+                assert np.isclose(mc_out['power'], an_out['power'], atol=5), (f'{mode=} {name=} {error_val=} '
+                                                                             f'{mc_out["power"]=} '
+                                                                             f'{an_out["power"]=}')
+
+
+def test_screen_power():
+    print_myself()
+    true_conc = np.linspace(10, 8, 30)
+    for mode in ['linear-regression', 'mann-kendall']:
+        dp = DetectionPowerCalculator(significance_mode=mode, nsims=1000)
+        # the mann kendall screen is approximate so it must be switched on
+        dp_screen = DetectionPowerCalculator(significance_mode=mode, nsims=1000, screen_power=True,
+                                             screen_approximate=mode == 'mann-kendall')
+        screens = []
+        for error_val in [0.05, 0.5, 1.5, 3]:
+            full = dp.power_calc(idv='screen', error=error_val, true_conc_ts=true_conc, mrt_model='pass_true_conc')
+            screened = dp_screen.power_calc(idv='screen', error=error_val, true_conc_ts=true_conc,
+                                            mrt_model='pass_true_conc')
+            screens.append(screened['screen'])
+            assert screened['power'] == full['power'], f'{mode=} {error_val=}'
+        # no change in the noise free data
+        screened = dp_screen.power_calc(idv='screen', error=1, true_conc_ts=np.zeros_like(true_conc),
+                                        mrt_model='pass_true_conc')
+        screens.append(screened['screen'])
+        assert screened['power'] == 0
+        assert screens == ['analytic_100', 'analytic_100', 'simulated', 'simulated', 'analytic_0'], screens
+        assert dp_screen.screen_counts == {'analytic_0': 1, 'analytic_100': 2, 'efficient_mode': 0, 'simulated': 2,
+                                           'cached': 0, 'checkpoint': 0}
+
+    # without screen_approximate the mann kendall modes are not screened
+    dp_screen = DetectionPowerCalculator(significance_mode='mann-kendall', nsims=100, screen_power=True)
+    screened = dp_screen.power_calc(idv='screen', error=0.05, true_conc_ts=true_conc, mrt_model='pass_true_conc')
+    assert screened['screen'] == 'simulated'
+
+
+def test_linregress_power_bounds():
+    print_myself()
+    from gw_detect_power.change_detection_v2 import (_analytic_linregress_power_bounds, _analytic_linregress_power,
+                                                     _batch_linregress)
+    rng = np.random.default_rng(5548)
+    x = np.arange(30)
+    lag = np.concatenate([np.full(10, 10.), np.linspace(10, 8, 20)])  # lack of fit
+    for name, true_y in [('linear', np.linspace(10, 8, 30)), ('lag', lag), ('flat', np.full(30, 10.))]:
+        for error in [0.1, 0.5, 1, 2, 4]:
+            for expected_slope in [None, -1, 1]:
+                lower, upper = _analytic_linregress_power_bounds(true_y, error, 0.05, expected_slope)
+                point = _analytic_linregress_power(true_y, error, 0.05, expected_slope)
+                assert lower <= point + 1e-12 and point <= upper + 1e-12, (name, error, lower, point, upper)
+                y = true_y + rng.normal(0, error, (4000, 30))
+                slope, _, p = _batch_linregress(x, y)
+                detected = p < 0.05
+                if expected_slope is not None:
+                    detected &= np.sign(slope) == np.sign(expected_slope)
+                # the monte carlo power lies within the bounds (allowing for the monte carlo error)
+                assert lower - 0.02 <= detected.mean() <= upper + 0.02, (name, error, expected_slope, lower,
+                                                                         detected.mean(), upper)
+
+
+def test_get_id_codes():
+    print_myself()
+    rng = np.random.default_rng(65)
+    test_vals = [
+        rng.choice([0.5, 0.51, 0.549, 0.551, 1., np.nan], 500),
+        rng.choice([1, 2, 5], 500),
+        np.array(rng.choice([1., 1.04, None, 3.], 500), dtype=object),
+        np.array(rng.choice([1, 1.0, None, 3.], 500), dtype=object),  # 1 and 1.0 have different id strings
+        np.full(500, None),
+        rng.choice(['piston_flow', 'pass_true_conc'], 500),
+    ]
+    for vals in test_vals:
+        for percision in [0, 1, 2]:
+            codes = DetectionPowerCalculator._get_id_codes(vals, 'test', percision)
+            id_strs = np.array([DetectionPowerCalculator._get_id_str(v, 'test', percision) for v in vals])
+            # same partition of the values
+            expect_codes = pd.factorize(id_strs)[0]
+            assert np.array_equal(pd.factorize(codes)[0], expect_codes), f'{vals[:5]=} {percision=}'
+
+
+def test_condense_seed():
+    print_myself()
+    dpc = DetectionPowerCalculator(significance_mode='linear-regression', nsims=100, ncores=1)
+    kwargs = dict(id_vals=np.arange(4), error_vals=np.array([6., 6.01, 6., 6.]), samp_years_vals=10,
+                  samp_per_year_vals=4, implementation_time_vals=5, initial_conc_vals=10, target_conc_vals=5,
+                  previous_slope_vals=0, max_conc_vals=25, min_conc_vals=1, mrt_model_vals='piston_flow',
+                  mrt_vals=0.0)
+    # rows 0 and 1 are the same run within the rounding, rows that differ only by seed are not condensed
+    got = dpc.mulitprocess_power_calcs(None, seed=np.array([1, 1, 2, 3]), **kwargs)
+    assert got.loc[0, 'power'] == got.loc[1, 'power']
+    for i, seed in [(2, 2), (3, 3)]:
+        expect = dpc.mulitprocess_power_calcs(None, seed=seed, **kwargs)
+        assert got.loc[i, 'power'] == expect.loc[i, 'power'], (i, got.loc[i, 'power'], expect.loc[i, 'power'])
+    # previously rows 2 and 3 were condensed into row 0 and returned its (seed 1) power
+    assert got.loc[2, 'power'] != got.loc[0, 'power'] and got.loc[3, 'power'] != got.loc[0, 'power'], got['power']
+
+
+def test_conc_id_codes():
+    print_myself()
+    get_codes = DetectionPowerCalculator._get_conc_id_codes
+    vals = np.array([5.01, 5.02, 5.01, 5.02, 5.0000001])
+    canon_idx = np.array([True, True, False, False, True])
+    # only the canonicalized rows are condensed at 1e-6, the others keep the 1 decimal precision
+    codes = get_codes(vals, 'target_conc', canon_idx)
+    assert codes[0] != codes[1] and codes[2] == codes[3], codes
+    assert codes[0] != codes[2] and codes[1] != codes[3], codes  # canonicalized and other rows never share a code
+    assert len(set(codes)) == 4, codes
+    no_canon = get_codes(vals, 'target_conc', np.zeros(5, dtype=bool))
+    assert np.array_equal(no_canon, DetectionPowerCalculator._get_id_codes(vals, 'target_conc'))
+
+
+def test_canonicalize():
+    print_myself()
+    indata = pd.DataFrame(itertools.product([4, 5.6, 8, 10], [0.1, 0.2, 0.5, 1.0], [0.1, 0.25], [0, 3]),
+                          columns=['start', 'noise', 'red', 'mrt'])
+    indata['target'] = indata.start - indata.start * indata.red
+    for mode in ['linear-regression', 'mann-kendall']:
+        dpc = DetectionPowerCalculator(significance_mode=mode, nsims=200, min_samples=5, ncores=2)
+        outs = []
+        for canonicalize in [False, True]:
+            outs.append(dpc.mulitprocess_power_calcs(
+                None, id_vals=indata.index.values, error_vals=indata.noise.values, samp_years_vals=10,
+                samp_per_year_vals=4, implementation_time_vals=5, initial_conc_vals=indata.start.values,
+                target_conc_vals=indata.target.values, previous_slope_vals=indata.noise.values * 0.5,
+                max_conc_vals=indata.start.values * 1.2, min_conc_vals=0, mrt_model_vals='piston_flow',
+                mrt_vals=indata.mrt.values, seed=5585, canonicalize=canonicalize))
+        # the test statistics are invariant to the transform so the results are identical
+        pd.testing.assert_frame_equal(outs[0], outs[1], check_dtype=False)
+
+
+def test_true_conc_dedup():
+    print_myself()
+    series_a = np.linspace(10, 8, 30)
+    series_b = np.linspace(10, 9, 30)
+    true_conc = [series_a, series_b, series_a.copy(), series_a + 1e-9, series_b, -0. * series_a]
+    codes = DetectionPowerCalculator._get_true_conc_codes(np.array(true_conc + [None], dtype=object))
+    assert np.array_equal(codes, [0, 1, 0, 0, 1, 2, -1]), codes
+
+    dpc = DetectionPowerCalculator(significance_mode='linear-regression', nsims=200, ncores=2)
+    errors = np.array([1., 1., 1., 1., 1., 0.5])
+    seeds = np.array([1, 1, 1, 2, 1, 1])
+    out = dpc.mulitprocess_power_calcs(None, id_vals=np.array(list('abcdef')), error_vals=errors,
+                                       mrt_model_vals='pass_true_conc', mrt_vals=0.0,
+                                       true_conc_ts_vals=true_conc, seed=seeds)
+    for idv, ts, error, seed in zip('abcdef', true_conc, errors, seeds):
+        expect = dpc.power_calc(idv=idv, error=error, true_conc_ts=ts, mrt_model='pass_true_conc', mrt=0.0,
+                                seed=seed)
+        assert out.loc[idv, 'power'] == expect['power'], idv
+
+
+def test_result_cache():
+    print_myself()
+    import tempfile
+    with tempfile.TemporaryDirectory() as tdir:
+        cache_path = Path(tdir).joinpath('cache.sqlite')
+        kwargs = dict(outpath=None, id_vals=np.arange(6), error_vals=np.array([0.5, 1, 1.5, 0.5, 1, 1.5]),
+                      samp_years_vals=10, samp_per_year_vals=4, implementation_time_vals=5,
+                      initial_conc_vals=10, target_conc_vals=np.array([5, 5, 5, 6, 6, 6]),
+                      previous_slope_vals=0, max_conc_vals=25, min_conc_vals=1, mrt_model_vals='piston_flow',
+                      mrt_vals=0.0, seed=5585)
+        no_cache = DetectionPowerCalculator(significance_mode='linear-regression', nsims=200, ncores=2)
+        expect = no_cache.mulitprocess_power_calcs(**kwargs)
+
+        dpc = DetectionPowerCalculator(significance_mode='linear-regression', nsims=200, ncores=2,
+                                       result_cache_path=cache_path, result_cache_max_entries=5)
+        first = dpc.mulitprocess_power_calcs(**kwargs)
+        assert dpc.result_cache.stats['misses'] == 6
+        assert dpc.result_cache.stats['entries'] == 5  # one evicted
+        pd.testing.assert_frame_equal(expect, first, check_dtype=False)
+
+        # a new calculator with the same options shares the cache
+        dpc = DetectionPowerCalculator(significance_mode='linear-regression', nsims=200, ncores=2,
+                                       result_cache_path=cache_path, result_cache_max_entries=5)
+        second = dpc.mulitprocess_power_calcs(**kwargs)
+        assert dpc.result_cache.stats['hits'] == 5, dpc.result_cache.stats
+        pd.testing.assert_frame_equal(expect, second, check_dtype=False)
+
+        # options that change the results change the key
+        dpc = DetectionPowerCalculator(significance_mode='linear-regression', nsims=100, ncores=2,
+                                       result_cache_path=cache_path)
+        dpc.mulitprocess_power_calcs(**kwargs)
+        assert dpc.result_cache.stats['hits'] == 0, dpc.result_cache.stats
+
+        # cache hits are counted in the screen counts so the counts add up to the number of runs
+        screen_kwargs = dict(significance_mode='linear-regression', nsims=200, ncores=2, screen_power=True,
+                             result_cache_path=Path(tdir).joinpath('screen_cache.sqlite'))
+        dpc = DetectionPowerCalculator(**screen_kwargs)
+        dpc.mulitprocess_power_calcs(**kwargs)
+        assert dpc.screen_counts['cached'] == 0 and sum(dpc.screen_counts.values()) == 6, dpc.screen_counts
+        dpc = DetectionPowerCalculator(**screen_kwargs)
+        dpc.mulitprocess_power_calcs(**kwargs)
+        assert dpc.screen_counts['cached'] == 6 and sum(dpc.screen_counts.values()) == 6, dpc.screen_counts
+
+        # results are stored as json text (never pickled), a legacy table of pickled results is dropped unread
+        import sqlite3
+        from contextlib import closing
+        from gw_detect_power.change_detection_v2 import _PowerResultCache
+        legacy_path = Path(tdir).joinpath('legacy_cache.sqlite')
+        with closing(sqlite3.connect(legacy_path)) as conn, conn:
+            conn.execute('CREATE TABLE results (key TEXT PRIMARY KEY, result BLOB NOT NULL, created REAL NOT NULL, '
+                         'last_used REAL NOT NULL)')
+            conn.execute("INSERT INTO results VALUES ('a', x'80', 0, 0)")
+        cache = _PowerResultCache(legacy_path)
+        assert cache.get_many(['a']) == {} and cache.stats['entries'] == 0
+        result = {'idv': np.int64(3), 'power': np.float64(55.5), 'mrt_p1': np.nan, 'mrt_model': 'piston_flow',
+                  'python_error': None, 'true_conc_ts_none': np.bool_(True)}
+        cache.put_many({'b': result})
+        with closing(sqlite3.connect(legacy_path)) as conn:
+            tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+            stored = conn.execute('SELECT typeof(result) FROM power_results').fetchone()[0]
+        assert tables == ['power_results'] and stored == 'text', (tables, stored)
+        got = cache.get_many(['b'])['b']
+        assert np.isnan(got.pop('mrt_p1'))
+        assert got == {'idv': 3, 'power': 55.5, 'mrt_model': 'piston_flow', 'python_error': None,
+                       'true_conc_ts_none': True}, got
+
+
+def test_chunked_dispatch():
+    print_myself()
+    from gw_detect_power.change_detection_v2 import _cost_chunks, _RunCostModel
+    assert [len(c) for c in _cost_chunks(np.ones(10), 4)] == [1] * 10
+    assert [len(c) for c in _cost_chunks(np.ones(1000), 4)] == [63, 62] * 8
+    assert max(len(c) for c in _cost_chunks(np.ones(100000), 4)) == 1000
+    assert max(len(c) for c in _cost_chunks(np.ones(100000), 4, max_chunksize=50)) == 50
+    # most expensive first, a run costing more than the target is a chunk on its own
+    chunks = _cost_chunks(np.array([1, 100, 2, 3, 50, 1, 1]), 1, tasks_per_core=2)
+    assert [c.tolist() for c in chunks] == [[1], [4, 3, 2, 0, 5, 6]]
+    chunks = _cost_chunks(np.array([1, 100, 2, 3, 50, 1, 1]), 1, chunksize=3)
+    assert [c.tolist() for c in chunks] == [[1, 4, 3], [2, 0, 5], [6]]
+
+    cost_model = _RunCostModel('mann-kendall', True, nsims=1000)
+    costs = cost_model.predict([50, 1000, 5000])
+    assert (np.diff(costs) > 0).all()
+    # the correction is learned per octave of the number of samples, unseen octaves use the overall scale
+    cost_model.update([50], costs[:1], costs[0] * 2)
+    new_costs = cost_model.predict([50, 1000, 5000])
+    assert np.isclose(new_costs[0], costs[0] * 2 ** cost_model.smoothing)
+    assert np.allclose(new_costs[1:], costs[1:] * 2 ** cost_model.smoothing)
+    cost_model.update([1000], new_costs[1:2], new_costs[1] / 2)
+    assert np.isclose(cost_model.predict([1000])[0], new_costs[1] * 0.5 ** cost_model.smoothing)
+    assert np.isclose(cost_model.predict([50])[0], new_costs[0])
+
+    # the predicted cost ordering matches the observed run times of the current kernels
+    nsims = 20
+    cost_model = _RunCostModel('mann-kendall', True, nsims=nsims)
+    dpc = DetectionPowerCalculator(significance_mode='mann-kendall', nsims=nsims, efficent_mode=True,
+                                   return_true_conc=False, return_noisy_conc_itters=0)
+    nsamples = [60, 600, 3000]
+    observed = []
+    for n in nsamples:
+        t = time.perf_counter()
+        dpc.power_calc(idv=n, error=0.5, mrt_model='pass_true_conc', true_conc_ts=np.linspace(10, 5, n), seed=1)
+        observed.append(time.perf_counter() - t)
+    predicted = cost_model.predict(nsamples)
+    assert (np.argsort(predicted) == np.argsort(observed)).all(), (predicted, observed)
+
+    errors = np.repeat([0.5, 1, 1.5, 2], 5)
+    targets = np.tile([5, 5.5, 6, 6.5, 7], 4)
+    dpc = DetectionPowerCalculator(significance_mode='linear-regression', nsims=200, ncores=2)
+    outs = []
+    for chunksize in [1, 7, None]:
+        outs.append(dpc.mulitprocess_power_calcs(
+            None, id_vals=np.arange(20), error_vals=errors, samp_years_vals=10, samp_per_year_vals=4,
+            implementation_time_vals=5, initial_conc_vals=10, target_conc_vals=targets, previous_slope_vals=0,
+            max_conc_vals=25, min_conc_vals=1, mrt_vals=0.0, seed=5585, chunksize=chunksize))
+    for out in outs[1:]:
+        pd.testing.assert_frame_equal(outs[0], out)
+
+
+def test_power_calc_batch():
+    print_myself()
+    dpc = DetectionPowerCalculator(significance_mode='linear-regression', nsims=20, efficent_mode=False)
+    true_conc = np.linspace(10, 5, 20)
+    runs = [dict(idv='a', error=0.5, mrt_model='pass_true_conc', true_conc_ts=true_conc, seed=1),
+            dict(idv='b', error='bad', mrt_model='pass_true_conc', true_conc_ts=true_conc, seed=1),
+            dict(idv='c', error=1.0, mrt_model='pass_true_conc', true_conc_ts=true_conc, seed=2)]
+    # the preallocated columns match the frame built from the run dicts, unset numeric inputs are NaN not None
+    expect = dpc._typed_results(pd.DataFrame([dpc._power_calc_mp(kwargs) for kwargs in runs]))
+    got = dpc._power_calc_batch(runs)
+    pd.testing.assert_frame_equal(got, expect[got.columns])
+    assert got['python_error'].notna().tolist() == [False, True, False]
+    for col in ['mrt_p1', 'frac_p1', 'f_p1', 'f_p2', 'mrt_p2']:
+        assert got[col].dtype == np.float64 and got[col].isna().all(), col
+
+
+def test_worker_calculator():
+    print_myself()
+    from gw_detect_power import change_detection_v2
+    dpc = DetectionPowerCalculator(significance_mode='linear-regression', nsims=200, expect_slope=-1)
+    runs = [dict(idv=i, error=error, mrt_model='piston_flow', mrt=0, samp_years=10, samp_per_year=4,
+                 implementation_time=5, initial_conc=10, target_conc=5, prev_slope=0, max_conc=25, min_conc=1,
+                 mrt_p1=None, frac_p1=None, f_p1=None, f_p2=None, true_conc_ts=None, seed=5585)
+            for i, error in enumerate([0.5, 1, 2])]
+    try:
+        # as per _start_process (which also lowers the process priority)
+        change_detection_v2._worker_calculator = dpc._worker_copy()
+        got, elapsed = change_detection_v2._worker_power_calc_batch(runs)
+        assert change_detection_v2._worker_calculator.expect_slope == -1
+    finally:
+        change_detection_v2._worker_calculator = None
+    pd.testing.assert_frame_equal(got, dpc._power_calc_batch(runs))
+
+    # the workers use the calculator as configured, not rebuilt from its init kwargs, so subclasses with their own
+    # __init__ and attributes set after construction reach the workers
+    dpc = _ScaledErrorCalculator(2, significance_mode='linear-regression', nsims=200, ncores=1)
+    dpc.min_p_value = 0.01
+    kwargs = dict(id_vals=np.arange(3), error_vals=np.array([0.5, 1, 2]), samp_years_vals=10, samp_per_year_vals=4,
+                  implementation_time_vals=5, initial_conc_vals=10, target_conc_vals=5, previous_slope_vals=0,
+                  max_conc_vals=25, min_conc_vals=1, mrt_model_vals='piston_flow', mrt_vals=0.0, seed=5585)
+    got = dpc.mulitprocess_power_calcs(None, **kwargs)
+    expect = DetectionPowerCalculator(significance_mode='linear-regression', nsims=200, min_p_value=0.01)
+    expect = expect.mulitprocess_power_calcs(None, **dict(kwargs, error_vals=kwargs['error_vals'] * 2))
+    assert np.array_equal(got['power'], expect['power']), (got['power'], expect['power'])
+
+
+class _ScaledErrorCalculator(DetectionPowerCalculator):
+    """
+    scales the error of every run, with an __init__ signature that differs from DetectionPowerCalculator
+    """
+
+    def __init__(self, error_scale, **kwargs):
+        super().__init__(**kwargs)
+        self.error_scale = error_scale
+
+    def _power_calc_mp(self, kwargs):
+        kwargs = dict(kwargs, error=kwargs['error'] * self.error_scale)
+        return super()._power_calc_mp(kwargs)
+
+
+class _InterruptedCalculator(DetectionPowerCalculator):
+    """
+    fails (outside of the python_error capture) on runs with error == 1.5 to mimic an interrupted job
+    """
+
+    def _power_calc_mp(self, kwargs):
+        if kwargs['error'] == 1.5:
+            raise RuntimeError('interrupted')
+        return super()._power_calc_mp(kwargs)
+
+
+class _assert_logs:
+    """
+    context manager asserting that a message containing text is logged by the logger name
+    """
+
+    def __init__(self, name, text):
+        import logging
+        self.logger = logging.getLogger(f'gw_detect_power.{name}')
+        self.text = text
+        self.records = []
+
+    def __enter__(self):
+        import logging
+        self.handler = logging.Handler()
+        self.handler.emit = self.records.append
+        self.logger.addHandler(self.handler)
+        self.level = self.logger.level
+        self.logger.setLevel(logging.INFO)
+        return self
+
+    def __exit__(self, *exc):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+        if exc[0] is None:
+            assert any(self.text in r.getMessage() for r in self.records), [r.getMessage() for r in self.records]
+
+
+def test_checkpoint():
+    print_myself()
+    import tempfile
+    with tempfile.TemporaryDirectory() as tdir:
+        outpath = Path(tdir).joinpath('power.hdf')
+        checkpoint_dir = Path(tdir).joinpath('power_checkpoint')
+        kwargs = dict(id_vals=np.arange(6), error_vals=np.array([0.5, 1, 0.75, 1.25, 1.5, 1.5]),
+                      samp_years_vals=10, samp_per_year_vals=4, implementation_time_vals=5,
+                      initial_conc_vals=10, target_conc_vals=np.array([5, 5, 5, 6, 6, 7]),
+                      previous_slope_vals=0, max_conc_vals=25, min_conc_vals=1, mrt_model_vals='piston_flow',
+                      mrt_vals=0.0, seed=5585)
+        dpc = DetectionPowerCalculator(significance_mode='linear-regression', nsims=200, ncores=1)
+        expect = dpc.mulitprocess_power_calcs(None, **kwargs)
+
+        interrupted = _InterruptedCalculator(significance_mode='linear-regression', nsims=200, ncores=1)
+        try:
+            interrupted.mulitprocess_power_calcs(outpath, checkpoint_batch=2, chunksize=2, **kwargs)
+            raise AssertionError('should have raised')
+        except RuntimeError:
+            pass
+        assert len(list(checkpoint_dir.glob('batch_*.pkl'))) == 2
+        assert not outpath.exists()
+
+        got = dpc.mulitprocess_power_calcs(outpath, checkpoint_batch=2, **kwargs)
+        pd.testing.assert_frame_equal(expect, got, check_dtype=False)
+        assert got['mrt_model'].dtype == object
+        pd.testing.assert_frame_equal(expect, pd.read_hdf(outpath, 'data'), check_dtype=False)
+        assert not checkpoint_dir.exists()
+
+        # streamed results, resumed from an interrupted run, one dataframe per checkpoint batch
+        try:
+            interrupted.mulitprocess_power_calcs(outpath, checkpoint_batch=2, chunksize=2, **kwargs)
+            raise AssertionError('should have raised')
+        except RuntimeError:
+            pass
+        outpath.unlink()
+        with _assert_logs('change_detection_v2', '4 runs loaded from checkpoint'):
+            blocks = dpc.mulitprocess_power_calcs(outpath, checkpoint_batch=2, chunksize=2, stream_results=True,
+                                                  **kwargs)
+            blocks = list(blocks)
+        assert [len(b) for b in blocks] == [2, 2, 2]
+        got = pd.concat(blocks).sort_index()
+        pd.testing.assert_frame_equal(expect, got, check_dtype=False)
+        assert not checkpoint_dir.exists()
+        assert not outpath.exists()
+
+        # a checkpoint left by a different job at the same outpath is discarded rather than fanned out
+        try:
+            interrupted.mulitprocess_power_calcs(outpath, checkpoint_batch=2, chunksize=2, **kwargs)
+            raise AssertionError('should have raised')
+        except RuntimeError:
+            pass
+        other_kwargs = dict(kwargs, error_vals=kwargs['error_vals'] + 0.1)
+        other_expect = dpc.mulitprocess_power_calcs(None, **other_kwargs)
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            got = dpc.mulitprocess_power_calcs(outpath, checkpoint_batch=2, **other_kwargs)
+        assert any('not part of this job' in str(i.message) for i in w), [str(i.message) for i in w]
+        pd.testing.assert_frame_equal(other_expect, got, check_dtype=False)
+        assert not checkpoint_dir.exists()
+
+
+def test_adjust_shape():
+    print_myself()
+    from gw_detect_power.change_detection_v2 import _int_missing, _run_value
+    adjust = DetectionPowerCalculator._adjust_shape
+    shape = (4,)
+    assert np.array_equal(adjust(None, shape, True, True, 'x'), np.full(4, _int_missing))
+    assert np.array_equal(adjust(None, shape, True, False, 'x'), np.full(4, np.nan), equal_nan=True)
+    assert np.array_equal(adjust(5, shape, True, True, 'x'), np.full(4, 5))
+    assert np.array_equal(adjust(np.array([1, 2, 3, 4]), shape, True, True, 'x'), [1, 2, 3, 4])
+    got = adjust(np.array([1, None, 3, None], dtype=object), shape, True, True, 'x')
+    assert got.dtype == np.int64
+    assert [_run_value(v, is_int=True) for v in got] == [1, None, 3, None]
+    # large seeds keep their precision
+    big = 2 ** 62 + 1
+    assert adjust(np.array([big, None, 3, 4], dtype=object), shape, True, True, 'x')[0] == big
+    assert adjust(np.full(4, big), shape, True, True, 'x')[0] == big
+    assert adjust(big, shape, True, True, 'x')[0] == big
+    got = adjust(np.array([1.5, None, 3, 4], dtype=object), shape, True, False, 'x')
+    assert got.dtype == float
+    assert np.array_equal(got, [1.5, np.nan, 3., 4.], equal_nan=True)
+    bad_inputs = [
+        (2.5, True, True),  # non integer scalar
+        (np.array([1, 2.5, 3, 4]), True, True),  # non integer values
+        (np.array([1., 2., 3., 4.]), True, True),  # float dtype for an integer
+        (np.array([1, None, 3, np.nan], dtype=object), True, True),  # nan is not an integer
+        (np.array([1, 2, 3, _int_missing]), True, True),  # the missing value
+        (np.array([1, 'a', 3, 4], dtype=object), True, False),  # non number
+        (np.array([1, None, 3, 4], dtype=object), False, False),  # None not allowed
+        (None, False, False),
+        (np.arange(3), True, False),  # wrong shape
+    ]
+    for x, none_allowed, is_int in bad_inputs:
+        try:
+            adjust(x, shape, none_allowed, is_int, 'x')
+            raise ValueError(f'should have raised for {x=}')
+        except AssertionError:
+            pass
+
+
+def test_trusted_rows():
+    print_myself()
+    from gw_detect_power.change_detection_v2 import age_tools_imported
+    nan = np.nan
+    mrt_model = np.array(['piston_flow', 'piston_flow', 'pass_true_conc', 'pass_true_conc',
+                          'binary_exponential_piston_flow'])
+    has_true_conc = np.array([False, True, True, True, False])
+    lag_vals = np.array([10, 10, nan, 10, 10.])
+    kwargs = {k: lag_vals for k in ['samp_years', 'samp_per_year', 'implementation_time', 'initial_conc',
+                                    'target_conc', 'prev_slope', 'max_conc', 'min_conc']}
+    kwargs.update({k: np.array([nan, nan, nan, nan, 0.5]) for k in ['mrt_p1', 'frac_p1', 'f_p1', 'f_p2']})
+    trusted = DetectionPowerCalculator._trusted_rows(mrt_model, has_true_conc, **kwargs)
+    # piston flow with a true conc series and pass_true_conc with samp_years are not trusted
+    expect = [True, False, True, False, age_tools_imported]
+    assert np.array_equal(trusted, expect), trusted
+
+    # untrusted rows are checked by the run, so the check error is returned
+    dpc = DetectionPowerCalculator(significance_mode='linear-regression', nsims=100, ncores=1)
+    out = dpc.mulitprocess_power_calcs(None, id_vals=np.array(['good', 'bad']), error_vals=0.5,
+                                       mrt_model_vals='pass_true_conc', samp_years_vals=np.array([None, 10]),
+                                       true_conc_ts_vals=[np.linspace(10, 8, 30)] * 2, mrt_vals=0.0)
+    assert pd.isna(out.loc['good', 'python_error'])
+    assert 'samp_years must be None for pass_true_conc model' in out.loc['bad', 'python_error']
+
+
+def test_ragged_true_conc():
+    print_myself()
+    from gw_detect_power import RaggedTrueConc
+    series = [np.linspace(10, 8, 30), None, np.linspace(5, 6, 45), np.linspace(7, 7.5, 20)]
+    ragged = RaggedTrueConc.from_list(series)
+    assert len(ragged) == 4
+    assert np.array_equal(ragged.lengths, [30, 0, 45, 20])
+    assert ragged[1] is None
+    for ts, got in zip(series, ragged):
+        if ts is not None:
+            assert np.array_equal(ts, got)
+
+    shm, spec = ragged._to_worker_spec()
+    try:
+        shm2, shared = RaggedTrueConc._attach(spec)
+        assert np.array_equal(shared.values, ragged.values)
+        assert not shared.values.flags.writeable
+        del shared
+        shm2.close()
+    finally:
+        shm.close()
+        shm.unlink()
+
+    dpc = DetectionPowerCalculator(significance_mode='linear-regression', nsims=200, ncores=2)
+    kwargs = dict(id_vals=np.array(list('abcd')), error_vals=np.array([0.5, 0.5, 1., 1.]),
+                  mrt_model_vals=np.array(['pass_true_conc', 'piston_flow', 'pass_true_conc', 'pass_true_conc']),
+                  samp_years_vals=np.array([None, 10, None, None]), samp_per_year_vals=np.array([None, 4, None, None]),
+                  implementation_time_vals=np.array([None, 5, None, None]),
+                  initial_conc_vals=np.array([None, 10, None, None]), target_conc_vals=np.array([None, 5, None, None]),
+                  previous_slope_vals=np.array([None, 0, None, None]), max_conc_vals=np.array([None, 25, None, None]),
+                  min_conc_vals=np.array([None, 1, None, None]), mrt_vals=0.0, seed=5585)
+    from_list = dpc.mulitprocess_power_calcs(None, true_conc_ts_vals=series, **kwargs)
+    from_ragged = dpc.mulitprocess_power_calcs(None, true_conc_ts_vals=ragged, **kwargs)
+    pd.testing.assert_frame_equal(from_list, from_ragged)
+    assert from_list['python_error'].isna().all(), from_list['python_error'].dropna().iloc[0]
+    for idv, ts, error in zip('acd', [series[0], series[2], series[3]], [0.5, 1., 1.]):
+        expect = dpc.power_calc(idv=idv, error=error, true_conc_ts=ts, mrt_model='pass_true_conc', mrt=0.0,
+                                seed=5585)
+        assert from_list.loc[idv, 'power'] == expect['power'], idv
+
+
+def test_ragged_true_conc_on_disk():
+    print_myself()
+    import tempfile
+    from gw_detect_power import RaggedTrueConc
+    series = [np.linspace(10, 8, 30), np.linspace(5, 6, 45), None, np.linspace(7, 7.5, 20)]
+    with tempfile.TemporaryDirectory() as tdir:
+        store = RaggedTrueConc.create(Path(tdir).joinpath('store'), [0 if ts is None else len(ts) for ts in series])
+        for i, ts in enumerate(series):
+            if ts is not None:
+                store.values[store.offsets[i]:store.offsets[i + 1]] = ts
+        store.values.flush()
+        del store
+
+        loaded = RaggedTrueConc.load(Path(tdir).joinpath('store'))
+        assert isinstance(loaded.values, np.memmap)
+        assert loaded[2] is None
+        for ts, got in zip(series, loaded):
+            if ts is not None:
+                assert np.array_equal(ts, got)
+        RaggedTrueConc.from_list(series).save(Path(tdir).joinpath('saved'))
+        saved = RaggedTrueConc.load(Path(tdir).joinpath('saved'), mmap_mode=None)
+        assert np.array_equal(saved.values, loaded.values)
+        assert np.array_equal(saved.offsets, loaded.offsets)
+
+        # the digests are kept with the store, a created store has them once compute_digests is called
+        assert loaded.digests is None
+        assert DetectionPowerCalculator._get_true_conc_digests(loaded) is None
+        assert np.array_equal(DetectionPowerCalculator._get_true_conc_codes(loaded), [0, 1, -1, 3])
+        loaded.compute_digests()
+        reloaded = RaggedTrueConc.load(Path(tdir).joinpath('store'))
+        assert np.array_equal(reloaded.digests, saved.digests)
+        expect = DetectionPowerCalculator._get_true_conc_digests(series)
+        assert DetectionPowerCalculator._get_true_conc_digests(reloaded) == expect
+
+        dpc = DetectionPowerCalculator(significance_mode='linear-regression', nsims=200, ncores=2)
+        kwargs = dict(id_vals=np.arange(3), error_vals=np.array([0.5, 1., 1.]), mrt_model_vals='pass_true_conc',
+                      mrt_vals=0.0, seed=5585)
+        use_series = [series[0], series[1], series[3]]
+        from_list = dpc.mulitprocess_power_calcs(None, true_conc_ts_vals=use_series, **kwargs)
+        store = RaggedTrueConc.from_list(use_series)
+        store.save(Path(tdir).joinpath('use'))
+        from_disk = dpc.mulitprocess_power_calcs(None, true_conc_ts_vals=RaggedTrueConc.load(Path(tdir).joinpath('use')),
+                                                 **kwargs)
+        pd.testing.assert_frame_equal(from_list, from_disk)
+        assert from_disk['python_error'].isna().all()
+
+        # without digests the store series are not condensed (or cached) but give the same results
+        Path(tdir).joinpath('use', RaggedTrueConc.digests_name).unlink()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            no_digests = dpc.mulitprocess_power_calcs(
+                None, true_conc_ts_vals=RaggedTrueConc.load(Path(tdir).joinpath('use')), **kwargs)
+        assert any('no digests' in str(w.message) for w in caught)
+        pd.testing.assert_frame_equal(from_list, no_digests)
+
+
 def check_function_mpmk_check_step():
     dp_2part = DetectionPowerCalculator(
         significance_mode='n-section-mann-kendall', nsims=100,
@@ -1255,8 +2173,39 @@ if __name__ == '__main__':
     test_multpart_mann_kendall_power(show=plot_flag)
 
     test_efficient_mode_lr()
+    test_batch_linregress()
+    test_efficient_mode_constant()
+    test_batch_mann_kendall()
+    if kendall_stats is not None:
+        test_batch_mann_kendall_vs_kendall_stats()
+    test_segment_mann_kendall()
+    if kendall_stats is not None:
+        test_segment_mann_kendall_vs_kendall_stats()
+    test_pettitt_null()
+    test_batch_pettitt()
+    test_sequential_pettitt()
     test_efficent_mode_mann_kendall()
     test_efficient_mode_mpmk()
+    test_efficient_mode_pettitt()
+    test_adaptive_nsims()
+    test_analytic_power_lr()
+    test_analytic_power_mann_kendall()
+    test_screen_power()
+    test_linregress_power_bounds()
+    test_get_id_codes()
+    test_condense_seed()
+    test_conc_id_codes()
+    test_canonicalize()
+    test_true_conc_dedup()
+    test_result_cache()
+    test_chunked_dispatch()
+    test_power_calc_batch()
+    test_worker_calculator()
+    test_checkpoint()
+    test_adjust_shape()
+    test_trusted_rows()
+    test_ragged_true_conc()
+    test_ragged_true_conc_on_disk()
     check_function_mpmk_check_step()
 
     print('passed all unique tests, now for longer tests')